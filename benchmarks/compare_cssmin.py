@@ -0,0 +1,70 @@
+"""Copyright (c) 2012 Charles Kaminski (CharlesKaminski@gmail.com)
+
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE."""
+
+# Compares the css minimizer with cssmin_original.py, the _cssmin.py it
+# replaced, kept here unchanged.  Both minimize a fixed corpus of generated
+# stylesheets, and the stylesheets named on the command line, with and
+# without line wrapping.  The original never returns on an unterminated
+# /*! comment, so the corpus has none.
+# usage: python benchmarks/compare_cssmin.py [file.css ...]
+
+import os
+import sys
+import random
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'tmin', 'management', 'commands'))
+from cssmin_original import cssmin as cssmin_original
+from _cssmin import cssmin
+
+PARTS = ['/* comment */', '/*! kept */', '/* ie mac \\*/', '/* */',
+         '@charset "utf-8";', '@media screen and(max-width:10px)',
+         'a :link', 'p:hover', 'ul li a', '{', '}', ';', ';;', ' ', '\n',
+         '\t', 'margin: 0px 0em 0 0%;', 'padding:0 0 0;', 'border:0 0;',
+         'background-position:0 0 0 0;', 'color: rgb(51, 102, 153);',
+         'color:#AABBCC;', 'color: #aabbcd;', 'width: 0.50em;',
+         'height:00.5px;', 'font-family: "a  b";', 'content:"\\"}\\"";',
+         '> +', ',', '!important', '(', ')', '[', ']', '=', "'#AABBCC'"]
+
+def generate_corpus(count, seed=0):
+    """Returns count stylesheets made of PARTS.  The same arguments always
+    generate the same corpus."""
+    rnd = random.Random(seed)
+    return [''.join(rnd.choice(PARTS) for i in xrange(rnd.randint(1, 80)))
+            for n in xrange(count)]
+
+if __name__ == '__main__':
+    corpus = generate_corpus(3000)
+    corpus.extend([open(name, 'rb').read() for name in sys.argv[1:]])
+
+    results = []
+    for name, f in (('cssmin_original', cssmin_original), ('cssmin', cssmin)):
+        start = time.time()
+        results.append([(f(css), f(css, wrap=20)) for css in corpus])
+        print '%-16s %8.3f s' % (name, time.time() - start)
+    differ = [css for css, old, new in zip(corpus, *results) if old != new]
+    print 'Same output: %s of %s stylesheets' % (len(corpus) - len(differ),
+                                                 len(corpus))
+    for css in differ[:5]:
+        print repr(css)
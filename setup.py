@@ -17,11 +17,24 @@ setup(name='django-template-minimizer',
                   'tmin.management.__init__',
                   'tmin.management.commands.__init__',
                   'tmin.management.commands.minimizetemplates',
+                  'tmin.management.commands.benchmarktemplates',
+                  'tmin.management.commands._Benchmark',
                   'tmin.management.commands._cssmin',
+                  'tmin.management.commands._ExternalMinimizer',
                   'tmin.management.commands._JavascriptMinify',
                   'tmin.management.commands._ManageMinimizers',
+                  'tmin.management.commands._MinimizerCache',
+                  'tmin.management.commands._Profiler',
                   'tmin.management.commands._SimpleHTMLParser',
-                  'tmin.management.commands._TemplateTextMinimizer',],
+                  'tmin.management.commands._TemplateBundle',
+                  'tmin.management.commands._TemplateGraph',
+                  'tmin.management.commands._TemplateKeys',
+                  'tmin.management.commands._TemplateTextMinimizer',
+                  'tmin.management.commands._TemplateWatcher',
+                  'tmin.management.commands._TemplateWriter',
+                  'tmin.management.commands._TransferSize',
+                  'tmin.loaders',
+                  'tmin.middleware',],
       classifiers=[
           'Development Status :: 4 - Beta',
           'Environment :: Web Environment',
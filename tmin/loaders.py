@@ -0,0 +1,172 @@
+"""Copyright (c) 2012 Charles Kaminski (CharlesKaminski@gmail.com)
+
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE."""
+
+from os.path import getmtime
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.template import TemplateDoesNotExist
+try:
+    # Django 1.8 and later; loaders are found through the template engine
+    from django.template.loaders.base import Loader as BaseLoader
+    find_template_loader = None
+except ImportError:
+    from django.template.loader import BaseLoader, find_template_loader
+from tmin.management.commands._TemplateTextMinimizer import \
+     minimize_template_text
+from tmin.management.commands._MinimizerCache import LRUCache
+from tmin.management.commands._TemplateBundle import TemplateBundle
+
+# Number of minimized templates kept in memory by each loader
+LOADER_CACHE_SIZE = 1000
+BUNDLE_NOT_SET = ('tmin.loaders.BundleLoader needs the '
+                  'MINIMIZED_TEMPLATE_BUNDLE setting.')
+
+def get_mtime(origin):
+    """Returns the modification time of the file a template was loaded
+    from or None if it did not come from a file."""
+    try:
+        return getmtime(origin)
+    except (OSError, TypeError, ValueError):
+        return None
+
+class Loader(BaseLoader):
+    """A template loader that minimizes templates in memory as they are
+    loaded.  Templates on disk are left alone.
+
+    Wraps other loaders the same way django's cached loader does::
+
+        TEMPLATE_LOADERS = (
+            ('tmin.loaders.Loader', (
+                'django.template.loaders.filesystem.Loader',
+                'django.template.loaders.app_directories.Loader',
+            )),
+        )
+
+    On Django 1.8 and later the same tuple goes in the 'loaders' option of
+    the TEMPLATES setting.
+
+    Minimized templates are kept in an LRU cache keyed by the template's
+    origin and modification time, so an edited template is minimized again
+    the next time it is loaded.
+    """
+    is_usable = True
+
+    def __init__(self, *args):
+        # Django 1.8 and later pass the template engine before the loaders
+        BaseLoader.__init__(self, *args[:-1])
+        self._loaders = args[-1]
+        self._cached_loaders = []
+        size = getattr(settings, 'MINIMIZER_LOADER_CACHE_SIZE',
+                       LOADER_CACHE_SIZE)
+        self.cache = LRUCache(size)
+        # Where each template name was last found
+        # format -> {name_key: origin, ...}
+        self.origins = {}
+
+    def loaders(self):
+        # Resolve loaders on demand to avoid circular imports
+        if not self._cached_loaders:
+            cached_loaders = []
+            for loader in self._loaders:
+                if find_template_loader is None:
+                    loader = self.engine.find_template_loader(loader)
+                else:
+                    loader = find_template_loader(loader)
+                cached_loaders.append(loader)
+            self._cached_loaders = cached_loaders
+        return self._cached_loaders
+    loaders = property(loaders)
+
+    def load_source(self, template_name, template_dirs=None):
+        """Returns (source, origin) from the first wrapped loader that has
+        the template."""
+        for loader in self.loaders:
+            try:
+                return loader.load_template_source(template_name,
+                                                   template_dirs)
+            except TemplateDoesNotExist:
+                pass
+        raise TemplateDoesNotExist(template_name)
+
+    def load_template_source(self, template_name, template_dirs=None):
+        name_key = template_name
+        if template_dirs:
+            name_key = '-'.join([template_name] + list(template_dirs))
+
+        # Skip the wrapped loaders if the template has not changed
+        origin = self.origins.get(name_key)
+        if origin is not None:
+            text = self.cache.get((origin, get_mtime(origin)))
+            if text is not None:
+                return (text, origin)
+
+        source, origin = self.load_source(template_name, template_dirs)
+        key = (origin, get_mtime(origin))
+        text = self.cache.get(key)
+        if text is None:
+            text = minimize_template_text(source)
+            self.cache.set(key, text)
+        self.origins[name_key] = origin
+        return (text, origin)
+
+    def reset(self):
+        "Empty the template cache."
+        self.cache.clear()
+        self.origins.clear()
+
+class BundleLoader(BaseLoader):
+    """A template loader that reads templates from a bundle written by
+    ``minimizetemplates -m --bundle FILE``::
+
+        MINIMIZED_TEMPLATE_BUNDLE = '/path/to/templates.bundle'
+        TEMPLATE_LOADERS = (
+            'tmin.loaders.BundleLoader',
+            'django.template.loaders.filesystem.Loader',
+        )
+
+    On Django 1.8 and later the loaders go in the 'loaders' option of the
+    TEMPLATES setting.  The bundle is memory mapped the first time a
+    template is loaded, so every process serving templates shares one copy
+    of it.  Templates are looked up by name; template_dirs is ignored.
+    """
+    is_usable = True
+
+    def __init__(self, *args, **kwargs):
+        BaseLoader.__init__(self, *args, **kwargs)
+        self.bundle = None
+
+    def get_bundle(self):
+        if self.bundle is None:
+            path = getattr(settings, 'MINIMIZED_TEMPLATE_BUNDLE', None)
+            if not path:
+                raise ImproperlyConfigured(BUNDLE_NOT_SET)
+            self.bundle = TemplateBundle(path)
+        return self.bundle
+
+    def load_template_source(self, template_name, template_dirs=None):
+        bundle = self.get_bundle()
+        text = bundle.get(template_name)
+        if text is None:
+            raise TemplateDoesNotExist(template_name)
+        charset = getattr(settings, 'FILE_CHARSET', 'utf-8')
+        return (text.decode(charset), '%s:%s' % (bundle.path, template_name))
@@ -0,0 +1,207 @@
+"""Copyright (c) 2012 Charles Kaminski (CharlesKaminski@gmail.com)
+
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE."""
+
+import sys
+import math
+import random
+from time import time
+from _TemplateTextMinimizer import minimize_template_text
+from _ManageMinimizers import MINIMIZERS
+from _TemplateTextMinimizer import RE_SCRIPT, RE_STYLE
+from tmin.middleware import MinimizeHTMLMiddleware, minimize_html
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+PERCENTILES = (50, 90, 99)
+
+# Building blocks of the generated templates
+HTML_SNIPPETS = [
+    '<div class="item">\n    <p>Lorem ipsum dolor sit amet,   consectetur\n'
+    '    adipiscing elit.</p>\n</div>\n',
+    '<ul>\n  <li><a href="/one/">One</a></li>\n'
+    '  <li><a href="/two/">Two</a></li>\n</ul>\n',
+    '<table>\n  <tr>\n    <td>  cell  </td>\n    <td>  cell  </td>\n'
+    '  </tr>\n</table>\n',
+    '<h2>   A heading   </h2>\n<img src="/static/img.png" alt="An image" />\n',
+    ]
+DJANGO_SNIPPETS = [
+    '{{ object.title }}',
+    '{{ value|default:"nothing"|upper }}',
+    '{% if user.is_authenticated %}',
+    '{% endif %}',
+    '{% for item in items %}',
+    '{% endfor %}',
+    '{% url "view-name" item.pk %}',
+    '{# A one line comment #}',
+    '{% comment %}\nA longer comment\n{% endcomment %}',
+    ]
+SCRIPT_SNIPPETS = [
+    '/* Update the counter */\nfunction update(counter) {\n'
+    '    var total = 0;\n    for (var i = 0; i < counter.length; i++) {\n'
+    '        total += counter[i];   // running total\n    }\n'
+    '    return total;\n}\n',
+    'var settings = {\n    "name": "value",\n    \'other\': [1, 2, 3],\n'
+    '    pattern: /a+b*/g\n};\n',
+    'document.getElementById("item").onclick = function (event) {\n'
+    '    event.preventDefault();\n    update([1, 2, 3]);\n};\n',
+    ]
+STYLE_SNIPPETS = [
+    '/* Layout */\n.item {\n    margin: 0px 0px 0px 0px;\n'
+    '    padding: 0.5em;\n    color: #AABBCC;\n}\n',
+    'ul li a:hover {\n    background-color: rgb(51, 102, 153);\n'
+    '    text-decoration: none;\n}\n',
+    'table td {\n    border: 1px solid #000000;\n    font-size: 12px;\n}\n',
+    ]
+
+def generate_template(rnd, size, tag_density=0.2, script_share=0.2,
+                      style_share=0.1):
+    """Returns a generated template of about size bytes.
+
+    tag_density is the share of html snippets followed by Django markup.
+    script_share and style_share are the shares of the template's bytes in
+    <script> and <style> blocks."""
+
+    pieces = []
+    length = 0
+    script_length = 0
+    style_length = 0
+    while length < size:
+        if script_length < size * script_share:
+            block = ''.join([rnd.choice(SCRIPT_SNIPPETS)
+                             for i in xrange(rnd.randint(1, 4))])
+            block = '<script type="text/javascript">\n%s</script>\n' % block
+            script_length = script_length + len(block)
+        elif style_length < size * style_share:
+            block = ''.join([rnd.choice(STYLE_SNIPPETS)
+                             for i in xrange(rnd.randint(1, 4))])
+            block = '<style type="text/css">\n%s</style>\n' % block
+            style_length = style_length + len(block)
+        else:
+            block = rnd.choice(HTML_SNIPPETS)
+            while rnd.random() < tag_density:
+                block = block + rnd.choice(DJANGO_SNIPPETS) + '\n'
+        # Interleave the blocks with the html
+        position = rnd.randint(0, len(pieces))
+        pieces.insert(position, block)
+        length = length + len(block)
+    return ''.join(pieces)
+
+def generate_corpus(count, size, tag_density=0.2, script_share=0.2,
+                    style_share=0.1, seed=0):
+    """Returns a list of count generated templates.  The same arguments
+    always generate the same corpus."""
+    rnd = random.Random(seed)
+    return [generate_template(rnd, size, tag_density, script_share,
+                              style_share) for i in xrange(count)]
+
+def extract_blocks(texts):
+    """Returns the contents of the script and style tags in texts ->
+    (scripts, styles)"""
+    scripts, styles = [], []
+    for text in texts:
+        scripts.extend([match.group(2) for match in RE_SCRIPT.finditer(text)])
+        styles.extend([match.group(2) for match in RE_STYLE.finditer(text)])
+    return (scripts, styles)
+
+def run_chain(chain):
+    def f(text):
+        for minimizer in chain: text = minimizer(text)
+        return text
+    return f
+
+def time_stage(f, items, repeat=3):
+    """Calls f on every item repeat times.  Returns the fastest time of
+    each item in seconds."""
+    samples = []
+    for item in items:
+        best = None
+        for i in xrange(repeat):
+            start = time()
+            f(item)
+            elapsed = time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        samples.append(best)
+    return samples
+
+def percentile(samples, p):
+    """Returns the p-th percentile of a sorted list (nearest rank)."""
+    if not samples:
+        return 0.0
+    rank = int(math.ceil(p / 100.0 * len(samples))) - 1
+    return samples[min(max(rank, 0), len(samples) - 1)]
+
+def summarize(samples, size):
+    """Returns the statistics of a stage as a dictionary.  size is the
+    number of bytes processed by one pass over the items."""
+    samples = sorted(samples)
+    seconds = sum(samples)
+    result = {
+        'items': len(samples),
+        'bytes': size,
+        'seconds': seconds,
+        'mb_per_s': seconds and size / seconds / (1024 * 1024) or 0.0,
+        }
+    for p in PERCENTILES:
+        result['p%s_ms' % p] = percentile(samples, p) * 1000
+    result['max_ms'] = samples and samples[-1] * 1000 or 0.0
+    return result
+
+def peak_memory():
+    """Returns the peak resident memory of the process in kilobytes or None.
+    ru_maxrss is in kilobytes on Linux and in bytes on Mac OS X."""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        usage = usage // 1024
+    return usage
+
+def benchmark_corpus(texts, repeat=3):
+    """Times minimize_template_text, the javascript and css minimizer
+    chains and the html middleware separately over a corpus.  The
+    'middleware' stage minimizes every response and the 'middleware-hit'
+    stage serves every response from a warm cache.  Returns ->
+    {stage_name: statistics, ...}"""
+
+    scripts, styles = extract_blocks(texts)
+    middleware = MinimizeHTMLMiddleware()
+    middleware.cache.max_entries = max(middleware.cache.max_entries,
+                                       len(texts))
+    for text in texts:
+        middleware.minimize(text)
+    stages = [('template', minimize_template_text, texts),
+              ('javascript', run_chain(MINIMIZERS.get('javascript')), scripts),
+              ('css', run_chain(MINIMIZERS.get('css')), styles),
+              ('middleware', minimize_html, texts),
+              ('middleware-hit', middleware.minimize, texts)]
+
+    results = {}
+    for name, f, items in stages:
+        samples = time_stage(f, items, repeat)
+        results[name] = summarize(samples, sum([len(x) for x in items]))
+    return results
@@ -0,0 +1,288 @@
+"""Copyright (c) 2012 Charles Kaminski (CharlesKaminski@gmail.com)
+
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE."""
+
+import os
+import sys
+import atexit
+from subprocess import Popen, PIPE
+from threading import Lock, Condition
+
+# Number of worker processes an ExternalMinimizer starts at most
+WORKERS = 4
+
+class ExternalMinimizerError(Exception):
+    pass
+
+class ExternalMinimizer(object):
+    """A minimizer that hands text to a pool of long lived worker processes
+    running an external tool, so a run does not start one process per
+    script or style block::
+
+        JAVASCRIPT_MINIMIZERS = [ExternalMinimizer(['node', 'terser.js'])]
+
+    Workers are started as they are needed, up to max_workers, and are
+    shared by the threads of a process; see minimizetemplates --threads.
+    A worker reads requests from stdin and writes responses to stdout, one
+    after the other:
+
+        request  -> '<length>\\n' followed by length bytes of text
+        response -> 'OK <length>\\n' followed by the minimized text or
+                    'ERR <length>\\n' followed by an error message
+
+    See serve for a worker written in python.  Unicode text is sent as
+    utf-8.  A worker that exits or breaks the protocol is replaced.
+    """
+
+    def __init__(self, command, max_workers=WORKERS, cwd=None, env=None):
+        self.command = command
+        self.max_workers = max_workers
+        self.cwd = cwd
+        self.env = env
+        # Names the minimizer in profiles and cache fingerprints
+        self.__name__ = ' '.join(command)
+        self.lock = Lock()
+        # Notified when a worker turns idle or goes away
+        self.ready = Condition(self.lock)
+        self._reset()
+        atexit.register(self.close)
+
+    def _reset(self):
+        # Workers belong to the process that started them
+        self.pid = os.getpid()
+        self.workers = []
+        self.idle = []
+
+    def __call__(self, text):
+        is_unicode = isinstance(text, unicode)
+        if is_unicode:
+            text = text.encode('utf-8')
+        worker = self.acquire()
+        try:
+            status, value = self.request(worker, text)
+        except:
+            self.discard(worker)
+            raise
+        self.release(worker)
+        if status != 'OK':
+            raise ExternalMinimizerError('%s failed: %s' % (self.__name__,
+                                                            value))
+        if is_unicode:
+            value = value.decode('utf-8')
+        return value
+
+    def acquire(self):
+        """Returns an idle worker, starting one if there are fewer than
+        max_workers.  Blocks until one is idle, or until a worker goes away
+        and a new one can be started, otherwise."""
+        self.lock.acquire()
+        try:
+            if self.pid != os.getpid():
+                self._reset()
+            while True:
+                if self.idle:
+                    return self.idle.pop()
+                if len(self.workers) < self.max_workers:
+                    worker = Popen(self.command, stdin=PIPE, stdout=PIPE,
+                                   cwd=self.cwd, env=self.env)
+                    self.workers.append(worker)
+                    return worker
+                self.ready.wait()
+        finally:
+            self.lock.release()
+
+    def release(self, worker):
+        """Hands a worker back once a request is done.  A worker left over
+        from before close is stopped."""
+        self.lock.acquire()
+        try:
+            if worker in self.workers:
+                self.idle.append(worker)
+                self.ready.notify()
+                return
+        finally:
+            self.lock.release()
+        stop_worker(worker)
+
+    def request(self, worker, text):
+        """Sends text to worker.  Returns (status, text)."""
+        worker.stdin.write('%d\n' % len(text))
+        worker.stdin.write(text)
+        worker.stdin.flush()
+        header = worker.stdout.readline()
+        try:
+            status, length = header.split()
+            length = int(length)
+        except ValueError:
+            raise ExternalMinimizerError('%s sent a bad response: %r' %
+                                         (self.__name__, header))
+        value = read_exactly(worker.stdout, length)
+        if value is None:
+            raise ExternalMinimizerError('%s exited' % self.__name__)
+        return (status, value)
+
+    def discard(self, worker):
+        """Stops a worker that exited or broke the protocol.  A thread
+        waiting for a worker starts one in its place."""
+        self.lock.acquire()
+        try:
+            if worker in self.workers:
+                self.workers.remove(worker)
+            self.ready.notify()
+        finally:
+            self.lock.release()
+        stop_worker(worker)
+
+    def close(self):
+        """Stops the workers.  New ones are started if the minimizer is
+        called again."""
+        self.lock.acquire()
+        try:
+            if self.pid == os.getpid():
+                for worker in self.workers:
+                    stop_worker(worker)
+            self._reset()
+            self.ready.notify_all()
+        finally:
+            self.lock.release()
+
+def stop_worker(worker):
+    try:
+        worker.stdin.close()
+        worker.wait()
+    except (IOError, OSError):
+        pass
+
+def read_exactly(stream, length):
+    """Reads length bytes from stream.  Returns None at the end of the
+    stream."""
+    pieces = []
+    while length > 0:
+        piece = stream.read(length)
+        if not piece:
+            return None
+        pieces.append(piece)
+        length = length - len(piece)
+    return ''.join(pieces)
+
+def serve(f, stdin=None, stdout=None):
+    """Runs a minimizer function as an ExternalMinimizer worker until stdin
+    is closed.  An exception raised by f is sent back as an error."""
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    while True:
+        header = stdin.readline()
+        if not header.strip():
+            return
+        text = read_exactly(stdin, int(header))
+        if text is None:
+            return
+        try:
+            status, value = 'OK', f(text)
+        except Exception, e:
+            status, value = 'ERR', '%s: %s' % (e.__class__.__name__, e)
+        stdout.write('%s %d\n' % (status, len(value)))
+        stdout.write(value)
+        stdout.flush()
+
+def import_function(path):
+    """Returns the function named by a dotted path."""
+    module, name = path.rsplit('.', 1)
+    return getattr(__import__(module, {}, {}, [name]), name)
+
+if __name__ == '__main__':
+    # python _ExternalMinimizer.py --serve module.function
+    #   Serves a minimizer function as a worker.
+    # python _ExternalMinimizer.py --check
+    #   Checks that threads waiting for a worker carry on when one exits.
+    # python _ExternalMinimizer.py [blocks]
+    #   Compares starting a process per block with a pool of workers.
+    import time
+    from multiprocessing import TimeoutError
+    from multiprocessing.pool import ThreadPool
+
+    if sys.argv[1:2] == ['--serve']:
+        serve(import_function(sys.argv[2]))
+        sys.exit(0)
+
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    if sys.argv[1:2] == ['--check']:
+        # One worker for three threads, each with one block.  The worker
+        # is slow, so the other threads are waiting when it exits on
+        # 'crash'.
+        worker = ('import os, sys, time\n'
+                  'sys.path.insert(0, %r)\n'
+                  'from _ExternalMinimizer import serve\n'
+                  'def f(text):\n'
+                  '    time.sleep(0.2)\n'
+                  '    if text == "crash":\n'
+                  '        os._exit(1)\n'
+                  '    return text.upper()\n'
+                  'serve(f)\n' % here)
+        minimizer = ExternalMinimizer([sys.executable, '-c', worker],
+                                      max_workers=1)
+        def call(text):
+            try:
+                return minimizer(text)
+            except ExternalMinimizerError:
+                return 'failed'
+        pool = ThreadPool(3)
+        texts = ['crash', 'crash', 'a']
+        try:
+            results = pool.map_async(call, texts, 1).get(30)
+        except TimeoutError:
+            print 'Waiting threads hung after a worker exited'
+            sys.exit(1)
+        pool.close()
+        minimizer.close()
+        print 'Results: %s' % results
+        print 'Same output: %s' % (
+            results == ['failed', 'failed', 'A'])
+        sys.exit(0)
+
+    blocks = int((sys.argv[1:] or ['200'])[0])
+    command = [sys.executable, os.path.abspath(__file__), '--serve',
+               '_JavascriptMinify.jsmin_fast']
+    js = 'function add(a, b) {\n    // Add two numbers\n    return a + b;\n}\n'
+    texts = [js * (i % 10 + 1) for i in xrange(blocks)]
+
+    def spawn(text):
+        worker = Popen(command, stdin=PIPE, stdout=PIPE, cwd=here)
+        status, value = pooled.request(worker, text)
+        stop_worker(worker)
+        return value
+
+    pooled = ExternalMinimizer(command, cwd=here)
+    results = []
+    for name, f, threads in (('process per block', spawn, 1),
+                             ('worker pool', pooled, 1),
+                             ('worker pool, %s threads' % WORKERS, pooled,
+                              WORKERS)):
+        start = time.time()
+        pool = ThreadPool(threads)
+        results.append(pool.map(f, texts))
+        pool.close()
+        elapsed = time.time() - start
+        print '%-26s %8.3f s  %8.2f ms per block' % (name, elapsed,
+                                                    elapsed * 1000 / blocks)
+    print 'Same output: %s' % (results[0] == results[1] == results[2])
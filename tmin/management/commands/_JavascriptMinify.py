@@ -30,6 +30,7 @@ import os, os.path, shutil
 # SOFTWARE.
 # */
 
+import re
 from StringIO import StringIO
 
 def jsmin(js):
@@ -49,6 +50,132 @@ def isAlphanum(c):
             (c >= 'A' and c <= 'Z') or c == '_' or c == '$' or c == '\\' or
             (c is not None and ord(c) > 126));
 
+# Characters jsmin_fast treats as letters; any character after '~' is too
+ALPHANUM = frozenset('abcdefghijklmnopqrstuvwxyz0123456789'
+                     'ABCDEFGHIJKLMNOPQRSTUVWXYZ_$\\')
+# A '/' after one of these starts a regular expression
+REGEX_PREFIX = frozenset('(,=:[?!&|;{}\n')
+# Newlines before these are kept
+NEWLINE_BEFORE = frozenset('{[(+-')
+# Newlines after these are kept
+NEWLINE_AFTER = frozenset('}])+-"\'')
+# Control characters other than linefeed read as spaces
+RE_CONTROL = re.compile('[\x00-\x09\x0b-\x1f]')
+
+def jsmin_fast(js):
+    """Same as jsmin but works by index over the input string and collects
+    the output in a list instead of reading and writing one character at a
+    time through StringIO.  Output and exceptions are identical to jsmin.
+    """
+    s = RE_CONTROL.sub(' ', js.replace('\r', '\n'))
+    n = len(s)
+    out = []
+    write = out.append
+
+    theA = '\n'
+    theB = None
+    i = 0
+    action = 3
+    while 1:
+        # See JavascriptMinify._action
+        if action <= 1:
+            write(theA)
+
+        if action <= 2:
+            theA = theB
+            if theA == "'" or theA == '"':
+                while 1:
+                    write(theA)
+                    if i < n: theA = s[i]
+                    else: theA = '\000'
+                    i = i + 1
+                    if theA == theB:
+                        break
+                    if theA <= '\n':
+                        raise UnterminatedStringLiteral()
+                    if theA == '\\':
+                        write(theA)
+                        if i < n: theA = s[i]
+                        else: theA = '\000'
+                        i = i + 1
+
+        theB, i = _next_fast(s, i, n, theA)
+        if theB == '/' and theA in REGEX_PREFIX:
+            write(theA)
+            write(theB)
+            while 1:
+                if i < n: theA = s[i]
+                else: theA = '\000'
+                i = i + 1
+                if theA == '/':
+                    break
+                elif theA == '\\':
+                    write(theA)
+                    if i < n: theA = s[i]
+                    else: theA = '\000'
+                    i = i + 1
+                elif theA <= '\n':
+                    raise UnterminatedRegularExpression()
+                write(theA)
+            theB, i = _next_fast(s, i, n, theA)
+
+        if theA == '\000':
+            break
+
+        # See JavascriptMinify._jsmin
+        if theA == ' ':
+            if theB in ALPHANUM or theB > '~':
+                action = 1
+            else:
+                action = 2
+        elif theA == '\n':
+            if theB in NEWLINE_BEFORE:
+                action = 1
+            elif theB == ' ':
+                action = 3
+            elif theB in ALPHANUM or theB > '~':
+                action = 1
+            else:
+                action = 2
+        elif theB == ' ':
+            if theA in ALPHANUM or theA > '~':
+                action = 1
+            else:
+                action = 3
+        elif theB == '\n':
+            if theA in NEWLINE_AFTER or theA in ALPHANUM or theA > '~':
+                action = 1
+            else:
+                action = 3
+        else:
+            action = 1
+
+    str = ''.join(out)
+    if len(str) > 0 and str[0] == '\n':
+        str = str[1:]
+    return str
+
+def _next_fast(s, i, n, theA):
+    """Returns (character, index) for the next character of s at index i,
+    skipping comments.  See JavascriptMinify._next."""
+    if i >= n:
+        return '\000', i + 1
+    c = s[i]
+    i = i + 1
+    if c == '/' and theA != '\\' and i < n:
+        p = s[i]
+        if p == '/':
+            i = s.find('\n', i + 1)
+            if i < 0:
+                return '\000', n + 1
+            return '\n', i + 1
+        if p == '*':
+            i = s.find('*/', i + 1)
+            if i < 0:
+                raise UnterminatedComment()
+            return ' ', i + 2
+    return c, i
+
 class UnterminatedComment(Exception):
     pass
 
@@ -243,4 +370,32 @@ def compress(in_files, out_file, in_type='js', verbose=False,
     print 'Reduction: %.1f%%' % (float(org_size - new_size) / org_size * 100)
     print ''
 
-    os.remove(temp_file)
\ No newline at end of file
+    os.remove(temp_file)
+
+if __name__ == '__main__':
+    # Benchmark jsmin against jsmin_fast.
+    # usage: python _JavascriptMinify.py [file.js ...]
+    import sys, time
+
+    if sys.argv[1:]:
+        js = '\n'.join([open(name, 'rb').read() for name in sys.argv[1:]])
+    else:
+        js = """/* A sample script */
+function add(a, b) {
+    // Add two numbers
+    var text = 'a + b = ' + (a + b);
+    return text.replace(/\\s+/g, " ");
+}
+"""
+        js = js * (200 * 1024 // len(js))
+
+    results = []
+    for f in (jsmin, jsmin_fast):
+        start = time.time()
+        results.append(f(js))
+        elapsed = time.time() - start
+        print '%-10s %8.3f s  %8.1f KB/s' % (f.__name__, elapsed,
+                                            len(js) / 1024.0 / elapsed)
+    print 'Input:  %s bytes' % len(js)
+    print 'Output: %s bytes' % len(results[0])
+    print 'Same output: %s' % (results[0] == results[1])
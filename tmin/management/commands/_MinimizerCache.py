@@ -0,0 +1,320 @@
+"""Copyright (c) 2012 Charles Kaminski (CharlesKaminski@gmail.com)
+
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE."""
+
+import sys
+from types import ModuleType
+from hashlib import sha1
+from os import walk, makedirs, remove, rename, utime, getpid
+from os.path import join, exists, getsize, getmtime
+from threading import Lock
+
+# Source hashes of the modules minimizers are defined in.
+# format -> {module_name: hex_digest, ...}
+_MODULE_HASHES = {}
+
+def get_fingerprint(*objects):
+    """Returns a hex digest identifying the given minimizers.
+
+    Accepts callables, modules, setting values and (nested) lists or
+    tuples of them.  A callable is identified by its module, its name, its
+    byte code and the source of the module it is defined in; so editing a
+    minimizer or reordering a chain changes the fingerprint.  A module is
+    identified by its name and source, for code a callable depends on in
+    other modules.
+    """
+    digest = sha1()
+    for obj in objects:
+        _update_fingerprint(digest, obj)
+    return digest.hexdigest()
+
+def _update_fingerprint(digest, obj):
+    if obj is None or isinstance(obj, (basestring, int, long, float)):
+        # Setting values
+        digest.update('%r;' % (obj,))
+        return
+    if isinstance(obj, (list, tuple)):
+        digest.update('[')
+        for item in obj:
+            _update_fingerprint(digest, item)
+        digest.update(']')
+        return
+    if isinstance(obj, ModuleType):
+        digest.update('%s;' % obj.__name__)
+        digest.update(_module_hash(obj.__name__))
+        return
+
+    module = getattr(obj, '__module__', None) or ''
+    name = getattr(obj, '__name__', None) or obj.__class__.__name__
+    digest.update('%s.%s;' % (module, name))
+
+    code = getattr(obj, 'func_code', None)
+    if code is None:
+        code = getattr(getattr(obj, '__call__', None), 'func_code', None)
+    if code is not None:
+        _update_code(digest, code)
+
+    digest.update(_module_hash(module))
+
+def _update_code(digest, code):
+    digest.update(code.co_code)
+    for const in code.co_consts:
+        if hasattr(const, 'co_code'):
+            _update_code(digest, const)
+        else:
+            digest.update(repr(const))
+
+def _module_hash(name):
+    if name not in _MODULE_HASHES:
+        value = ''
+        path = getattr(sys.modules.get(name), '__file__', None)
+        if path:
+            if path.endswith(('.pyc', '.pyo')):
+                path = path[:-1]
+            try:
+                value = sha1(open(path, 'rb').read()).hexdigest()
+            except IOError:
+                pass
+        _MODULE_HASHES[name] = value
+    return _MODULE_HASHES[name]
+
+class MinimizerCache(object):
+    """A persistent, on disk cache of minimized templates.
+
+    Entries are keyed by a hash of the template source and the fingerprint
+    of the minimizers that produced them.  Each entry is a file; entries are
+    written to a temporary file and renamed into place so that several
+    processes can share one cache directory.  A hit touches the entry's
+    modification time, which prune() uses to evict the least recently used
+    entries once the cache grows past max_size bytes.
+    """
+
+    def __init__(self, directory, fingerprint, max_size=None):
+        self.directory = directory
+        self.fingerprint = fingerprint
+        self.max_size = max_size
+
+    def key(self, text):
+        return sha1(self.fingerprint + '\0' + text).hexdigest()
+
+    def path(self, key):
+        return join(self.directory, key[:2], key)
+
+    def get(self, text):
+        """Returns the cached minimized text or None."""
+        return self.read(self.key(text))
+
+    def set(self, text, value):
+        self.write(self.key(text), value)
+
+    def read(self, key):
+        path = self.path(key)
+        try:
+            value = open(path, 'rb').read()
+        except IOError:
+            return None
+        try:
+            utime(path, None)
+        except OSError:
+            pass
+        return value
+
+    def write(self, key, value):
+        path = self.path(key)
+        d = join(self.directory, key[:2])
+        if not exists(d):
+            try:
+                makedirs(d)
+            except OSError:
+                # Another process created it first
+                pass
+        temp_path = '%s.%s.tmp' % (path, getpid())
+        f = open(temp_path, 'wb')
+        try:
+            f.write(value)
+        finally:
+            f.close()
+        rename(temp_path, path)
+
+    def prune(self, max_size=None):
+        """Removes the least recently used entries until the cache is no
+        larger than max_size bytes.  Returns the number of entries removed.
+        """
+        if max_size is None:
+            max_size = self.max_size
+        if max_size is None or not exists(self.directory):
+            return 0
+
+        entries = []
+        total = 0
+        for root, dirs, files in walk(self.directory):
+            for name in files:
+                path = join(root, name)
+                try:
+                    size, mtime = getsize(path), getmtime(path)
+                except OSError:
+                    continue
+                entries.append((mtime, size, path))
+                total = total + size
+
+        removed = 0
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= max_size:
+                break
+            try:
+                remove(path)
+            except OSError:
+                continue
+            total = total - size
+            removed = removed + 1
+        return removed
+
+class LRUCache(object):
+    """An in memory cache holding at most max_entries values.
+
+    Once full, setting a new key evicts the least recently used entry.
+    Entries are kept in a dictionary and in a doubly linked list ordered
+    from least to most recently used, so get and set take constant time.
+    The cache may be shared between threads.
+    """
+
+    # Link fields -> [previous_link, next_link, key, value]
+    PREV, NEXT, KEY, VALUE = 0, 1, 2, 3
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+        self.clear()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.links = {}
+            # The root link sits between the newest and the oldest entries
+            self.root = []
+            self.root[:] = [self.root, self.root, None, None]
+        finally:
+            self.lock.release()
+
+    def __len__(self):
+        return len(self.links)
+
+    def __contains__(self, key):
+        return key in self.links
+
+    def get(self, key, default=None):
+        """Returns the value for key or default.  A hit makes the entry the
+        most recently used."""
+        self.lock.acquire()
+        try:
+            link = self.links.get(key)
+            if link is None:
+                self.misses = self.misses + 1
+                return default
+            self.hits = self.hits + 1
+            self._unlink(link)
+            self._append(link)
+            return link[self.VALUE]
+        finally:
+            self.lock.release()
+
+    def set(self, key, value):
+        self.lock.acquire()
+        try:
+            link = self.links.get(key)
+            if link is not None:
+                self._unlink(link)
+                link[self.VALUE] = value
+            else:
+                if len(self.links) >= self.max_entries:
+                    oldest = self.root[self.NEXT]
+                    if oldest is self.root:
+                        # max_entries is 0; nothing is ever kept
+                        return
+                    self._unlink(oldest)
+                    del self.links[oldest[self.KEY]]
+                link = [None, None, key, value]
+                self.links[key] = link
+            self._append(link)
+        finally:
+            self.lock.release()
+
+    def _unlink(self, link):
+        link[self.PREV][self.NEXT] = link[self.NEXT]
+        link[self.NEXT][self.PREV] = link[self.PREV]
+
+    def _append(self, link):
+        newest = self.root[self.PREV]
+        link[self.PREV] = newest
+        link[self.NEXT] = self.root
+        newest[self.NEXT] = link
+        self.root[self.PREV] = link
+
+class BlockMemo(object):
+    """Remembers minimized script and style blocks so that a block found in
+    many templates is minimized once.  See
+    _TemplateTextMinimizer.set_block_memo.
+
+    Blocks are keyed by a hash of the opening tag, with its attributes, the
+    block's content and the fingerprint of the minimizers.  They are kept
+    in an LRUCache of max_entries blocks and, if a MinimizerCache is given
+    as the store, on disk as well so later runs and other processes find
+    them.  The memo may be shared between threads.
+    """
+
+    def __init__(self, fingerprint, store=None, max_entries=10000):
+        self.fingerprint = fingerprint
+        self.store = store
+        self.cache = LRUCache(max_entries)
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def key(self, tag, data):
+        return sha1('%s\0%s\0%s' % (self.fingerprint, tag, data)).hexdigest()
+
+    def get(self, tag, data):
+        """Returns the minimized block or None."""
+        key = self.key(tag, data)
+        block = self.cache.get(key)
+        if block is None and self.store is not None:
+            block = self.store.read(key)
+            if block is not None:
+                self.cache.set(key, block)
+        self.lock.acquire()
+        try:
+            if block is None:
+                self.misses = self.misses + 1
+            else:
+                self.hits = self.hits + 1
+        finally:
+            self.lock.release()
+        return block
+
+    def set(self, tag, data, block):
+        key = self.key(tag, data)
+        self.cache.set(key, block)
+        if self.store is not None:
+            self.store.write(key, block)
@@ -0,0 +1,69 @@
+"""Copyright (c) 2012 Charles Kaminski (CharlesKaminski@gmail.com)
+
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE."""
+
+from time import time
+
+class Profiler(object):
+    """Records wall time, call count and bytes in and out of the stages of
+    minimize_template_text and of every minimizer it calls.  Install one
+    with _TemplateTextMinimizer.set_profiler.
+
+    stages format -> {stage_name: [calls, seconds, bytes_in, bytes_out], ...}
+
+    Stage names are 'template' for the whole of minimize_template_text,
+    'django', 'styles', 'scripts', 'html' and 'revert' for its steps, and
+    'javascript:', 'css:' or 'html:' followed by module.name for each
+    minimizer.  Stages nest; 'styles' includes the css minimizers.
+    """
+
+    def __init__(self):
+        self.stages = {}
+
+    def begin(self, stage, text):
+        return (stage, len(text), time())
+
+    def end(self, mark, text):
+        stage, size, start = mark
+        seconds = time() - start
+        record = self.stages.get(stage)
+        if record is None:
+            record = self.stages[stage] = [0, 0.0, 0, 0]
+        record[0] = record[0] + 1
+        record[1] = record[1] + seconds
+        record[2] = record[2] + size
+        record[3] = record[3] + len(text)
+
+    def merge(self, stages):
+        """Adds the stages recorded by another profiler."""
+        for stage, other in stages.items():
+            record = self.stages.setdefault(stage, [0, 0.0, 0, 0])
+            for i in range(4):
+                record[i] = record[i] + other[i]
+
+    def slowest(self, limit=None):
+        """Returns the stages, slowest first ->
+        [(stage_name, calls, seconds, bytes_in, bytes_out), ...]"""
+        stages = [(stage,) + tuple(record)
+                  for stage, record in self.stages.items()]
+        stages.sort(key=lambda x: (-x[2], x[0]))
+        return stages[:limit]
@@ -0,0 +1,126 @@
+"""Copyright (c) 2012 Charles Kaminski (CharlesKaminski@gmail.com)
+
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE."""
+
+import mmap
+import struct
+from os import getpid, rename
+
+# Bundle file layout:
+#   header -> MAGIC, number of templates
+#   index  -> for each template: name length, data offset, data length
+#             followed by the utf-8 encoded template name
+#   data   -> the minimized templates, one after the other
+# Offsets are from the start of the file.  Numbers are little endian.
+MAGIC = 'TMINBDL1'
+HEADER = struct.Struct('<8sI')
+ENTRY = struct.Struct('<III')
+
+BUNDLE_INVALID = 'Not a minimized template bundle: %s'
+
+def write_bundle(path, templates):
+    """Writes a bundle of templates to path.
+
+    templates -> [(name, text), ...]
+    Names may be unicode.  Texts are byte strings.  The first template with
+    a given name wins.  The bundle is written to a temporary file and
+    renamed into place so readers never see a partial bundle.
+    Returns the number of templates in the bundle."""
+
+    seen = {}
+    entries = []
+    for name, text in templates:
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        if name not in seen:
+            seen[name] = True
+            entries.append((name, text))
+
+    index_length = sum([ENTRY.size + len(x[0]) for x in entries])
+    offset = HEADER.size + index_length
+
+    temp_path = '%s.%s.tmp' % (path, getpid())
+    f = open(temp_path, 'wb')
+    try:
+        f.write(HEADER.pack(MAGIC, len(entries)))
+        for name, text in entries:
+            f.write(ENTRY.pack(len(name), offset, len(text)))
+            f.write(name)
+            offset = offset + len(text)
+        for name, text in entries:
+            f.write(text)
+    finally:
+        f.close()
+    rename(temp_path, path)
+    return len(entries)
+
+class TemplateBundle(object):
+    """Read only access to a bundle written by write_bundle.
+
+    The file is memory mapped, so processes reading the same bundle share
+    one copy of it in the page cache.  Only the index is read when the
+    bundle is opened.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        f = open(path, 'rb')
+        try:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+        if len(self.map) < HEADER.size:
+            raise ValueError(BUNDLE_INVALID % path)
+        magic, count = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(BUNDLE_INVALID % path)
+
+        # format -> {name: (offset, length), ...}
+        self.index = {}
+        position = HEADER.size
+        for i in xrange(count):
+            name_length, offset, length = ENTRY.unpack_from(self.map, position)
+            position = position + ENTRY.size
+            name = self.map[position:position + name_length]
+            position = position + name_length
+            self.index[name.decode('utf-8')] = (offset, length)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def names(self):
+        return sorted(self.index)
+
+    def get(self, name):
+        """Returns the minimized template as a byte string or None."""
+        entry = self.index.get(name)
+        if entry is None:
+            return None
+        offset, length = entry
+        return self.map[offset:offset + length]
+
+    def close(self):
+        self.map.close()
@@ -0,0 +1,146 @@
+"""Copyright (c) 2012 Charles Kaminski (CharlesKaminski@gmail.com)
+
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE."""
+
+import re
+from fnmatch import fnmatch
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+FLAGS = re.IGNORECASE + re.DOTALL
+
+# {% extends %} and {% include %} tags.  The name is a string literal or,
+# when the template is chosen at render time, a variable.
+REFERENCE = (r'{%\s*(EXTENDS|INCLUDE)\s+'
+             r'(?:"([^"\n\r]*)"|\'([^\'\n\r]*)\'|([^\s%]+))')
+
+RE_REFERENCE = re.compile(REFERENCE, flags=FLAGS)
+
+class TemplateGraph(object):
+    """The {% extends %} and {% include %} references between templates.
+
+    Templates are added by name, as Django's loaders find them.  A name in
+    more than one template directory is read from the first, as the
+    loaders do.  References made with a variable can not be followed; the
+    templates that make them are listed in dynamic.
+    """
+
+    def __init__(self):
+        # format -> {template_name: [referenced_name, ...], ...}
+        self.extends = {}
+        self.includes = {}
+        self.dynamic = set()
+
+    def add(self, name, text):
+        """Reads the references of the template text."""
+        if name in self.extends:
+            return
+        extends, includes = [], []
+        for match in RE_REFERENCE.finditer(text):
+            tag, double, single, variable = match.groups()
+            if variable is not None:
+                self.dynamic.add(name)
+            elif tag.lower() == 'extends':
+                extends.append(double is None and single or double)
+            else:
+                includes.append(double is None and single or double)
+        self.extends[name] = extends
+        self.includes[name] = includes
+
+    def references(self, name):
+        return self.extends.get(name, []) + self.includes.get(name, [])
+
+    def reachable(self, roots):
+        """Returns the names of the templates whose names match one of the
+        shell style root patterns and of every template they extend or
+        include, directly or not -> set"""
+        stack = [name for name in self.extends
+                 if [x for x in roots if fnmatch(name, x)]]
+        seen = set()
+        while stack:
+            name = stack.pop()
+            if name not in seen:
+                seen.add(name)
+                stack.extend(self.references(name))
+        return seen
+
+    def dependents(self, names, parents=None):
+        """Returns the names of the templates that extend or include one of
+        names, directly or not -> set
+
+        These are the templates to minimize or bundle again when one of
+        names changes.  parents is the result of children(); it is worked
+        out if not given."""
+        if parents is None:
+            parents = self.children()
+        stack = list(names)
+        seen = set()
+        while stack:
+            for child in parents.get(stack.pop(), []):
+                if child not in seen:
+                    seen.add(child)
+                    stack.append(child)
+        return seen - set(names)
+
+    def children(self):
+        """Returns -> {template_name: [name_of_template_referencing_it, ...]}
+        """
+        parents = {}
+        for name in self.extends:
+            for reference in self.references(name):
+                parents.setdefault(reference, []).append(name)
+        return parents
+
+    def missing(self):
+        """Returns the referenced names not added to the graph, such as
+        templates of installed apps -> set"""
+        return set([reference for name in self.extends
+                    for reference in self.references(name)
+                    if reference not in self.extends])
+
+    def as_dict(self, roots=None):
+        """Returns the graph in a form that can be written as JSON."""
+        parents = self.children()
+        reachable = roots and self.reachable(roots) or set()
+        templates = {}
+        for name in self.extends:
+            templates[name] = {
+                'extends': self.extends[name],
+                'includes': self.includes[name],
+                'dependents': sorted(self.dependents([name], parents)),
+                'dynamic': name in self.dynamic,
+                }
+            if roots:
+                templates[name]['reachable'] = name in reachable
+        return {'roots': list(roots or []), 'templates': templates,
+                'missing': sorted(self.missing())}
+
+    def write(self, path, roots=None):
+        """Writes the graph to a file as JSON."""
+        f = open(path, 'wb')
+        try:
+            json.dump(self.as_dict(roots), f, indent=2, sort_keys=True)
+        finally:
+            f.close()
@@ -0,0 +1,307 @@
+"""Copyright (c) 2012 Charles Kaminski (CharlesKaminski@gmail.com)
+
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE."""
+
+import re
+
+# Keys are private use characters.  DIGITS of them are keys on their own;
+# the last LEADS start a key of two characters once those run out.
+FIRST  = 0xE000
+DIGITS = 0xF00
+LEADS  = 0x100
+LEAD   = FIRST + DIGITS
+
+# The same characters in unicode text and UTF-8 encoded in byte strings,
+# where they all start with the byte '\xee'.  The regular expression engine
+# looks for a plain first character much faster than for a set of them.
+# In byte strings, parts of the characters are keyed as well, so removing
+# a comment can not join bytes into a key.
+KEY           = u'[\ue000-\ueeff]|[\uef00-\uefff][\ue000-\ueeff]'
+PRIVATE       = u'[\ue000-\uefff]'
+KEY_BYTES     = (r'\xee(?:[\x80-\xbb]|[\xbc-\xbf][\x80-\xbf]\xee[\x80-\xbb])'
+                 r'[\x80-\xbf]')
+PRIVATE_BYTES = r'\xee[\x80-\xbf]?[\x80-\xbf]?'
+
+RE_KEY           = re.compile(KEY)
+RE_PRIVATE       = re.compile(PRIVATE)
+RE_KEY_BYTES     = re.compile(KEY_BYTES)
+RE_PRIVATE_BYTES = re.compile(PRIVATE_BYTES)
+
+# Keys of one character and their indexes, made as they are first needed
+# and shared by all templates
+# format -> {is_unicode: {index: key, ...}}
+KEYS    = {False: {}, True: {}}
+# format -> {key: index, ...}
+INDEXES = {}
+
+def make_key(index, is_unicode=False):
+    """Returns the key of index, unicode or UTF-8 encoded."""
+    if index < DIGITS:
+        key = unichr(FIRST + index)
+    else:
+        lead, digit = divmod(index - DIGITS, DIGITS)
+        if lead >= LEADS:
+            raise Exception('Too many Django tags, variables, scripts and '
+                            'styles in one template: %s' % index)
+        key = unichr(LEAD + lead) + unichr(FIRST + digit)
+    if is_unicode:
+        return key
+    return key.encode('utf-8')
+
+def key_index(key):
+    """Returns the index of a key, unicode or UTF-8 encoded."""
+    if not isinstance(key, unicode):
+        key = key.decode('utf-8')
+    index = ord(key[-1]) - FIRST
+    if len(key) > 1:
+        index = DIGITS + (ord(key[0]) - LEAD) * DIGITS + index
+    return index
+
+class TemplateKeys(object):
+    """The values taken out of a template while it is minimized.  Each
+    value is replaced in the text by a key, which is put back by looking it
+    up in a list.
+
+    A key is one private use character, U+E000 to U+EEFF, or two once those
+    run out, the first from U+EF00 to U+EFFF.  In byte strings keys are
+    UTF-8 encoded and take 3 or 6 bytes.  The minimizers leave them alone;
+    they are not whitespace and jsmin takes them for letters.  Characters
+    of that range already in the template, from an icon font for example,
+    are keyed first (see escape), so text is never mistaken for a key.
+    Byte strings in other encodings work as well; bytes that could be read
+    as part of such a character are keyed the same way.
+
+    text is the template, or its first piece; the keys are unicode if it
+    is.
+    """
+
+    def __init__(self, text=''):
+        self.unicode = isinstance(text, unicode)
+        if self.unicode:
+            self.regex, self.private = RE_KEY, RE_PRIVATE
+        else:
+            self.regex, self.private = RE_KEY_BYTES, RE_PRIVATE_BYTES
+        self.keys = KEYS[self.unicode]
+        # Values by index; set to None once put back by pop
+        # format -> [value, ...]
+        self.values = []
+        # Indexes of the characters of the template keyed by escape
+        self.literals = set()
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, value):
+        """Saves value and returns its key."""
+        index = len(self.values)
+        key = self.keys.get(index)
+        if key is None:
+            key = self.key(index)
+        self.values.append(value)
+        return key
+
+    def key(self, index):
+        key = self.keys.get(index)
+        if key is None:
+            key = make_key(index, self.unicode)
+            if index < DIGITS:
+                self.keys[index] = key
+                INDEXES[key] = index
+        return key
+
+    def index(self, key):
+        """Returns the index of key or None if key is not one of ours."""
+        index = INDEXES.get(key)
+        if index is None:
+            index = key_index(key)
+        if index < len(self.values):
+            return index
+        return None
+
+    def escape(self, text):
+        """Keys the characters of text keys are made of and, in byte
+        strings, the bytes that could be part of one."""
+        if not self.unicode and '\xee' not in text:
+            # Much faster than the regular expression
+            return text
+        def escape(match):
+            self.literals.add(len(self.values))
+            return self.add(match.group())
+        return self.private.sub(escape, text)
+
+    def lookup(self, key):
+        """Returns the value of key or None if key is not one of ours or
+        stands for a character of the template; see escape."""
+        index = self.index(key)
+        if index is None or index in self.literals:
+            return None
+        return self.values[index]
+
+    def revert(self, text):
+        """Puts the values back into text.  Keys in the values are put back
+        as the values are.  Every key must be found, except those made by
+        escape, which go with the comments they were in."""
+
+        if not text or not self.values:
+            return text
+
+        values = self.values
+        literals = self.literals
+        count = len(values)
+        sub = self.regex.sub
+        # format -> [reverted_value_or_None, ...]
+        reverted = [None] * count
+
+        def revert(match):
+            key = match.group()
+            index = INDEXES.get(key)
+            if index is None:
+                index = key_index(key)
+            if index >= count:
+                # Not one of ours
+                return key
+            value = reverted[index]
+            if value is None:
+                # Mark the key so a value embeded in itself is left alone
+                reverted[index] = key
+                value = values[index]
+                if index not in literals:
+                    value = sub(revert, value)
+                reverted[index] = value
+            return value
+
+        text = sub(revert, text)
+
+        missing = None in reverted and [
+            (self.key(i), values[i]) for i in xrange(count)
+            if reverted[i] is None and i not in literals]
+        if missing:
+            raise Exception('Minimizer failed to find all embeded variables.'
+                            '\n%s\n%s' % (missing, text))
+        return text
+
+    def pop(self, text):
+        """Puts the values of the keys in text back, like revert.  Values
+        put back are set to None; keys already put back are left alone."""
+
+        values = self.values
+        literals = self.literals
+        sub = self.regex.sub
+
+        def revert(match):
+            key = match.group()
+            index = self.index(key)
+            if index is None or values[index] is None:
+                # Not one of ours or already put back
+                return key
+            value = values[index]
+            values[index] = None
+            if index not in literals:
+                value = sub(revert, value)
+            return value
+
+        return sub(revert, text)
+
+    def truncate(self, length):
+        """Forgets the values saved after the first length."""
+        del self.values[length:]
+        self.literals = set([x for x in self.literals if x < length])
+
+    def missing(self):
+        """Returns the values not put back by pop, but for those made by
+        escape -> [(key, value), ...]"""
+        return [(self.key(i), value) for i, value in enumerate(self.values)
+                if value is not None and i not in self.literals]
+
+if __name__ == '__main__':
+    # Compare the keys with the '_~%s~_' keys and the list of (key, value)
+    # pairs they replaced over generated templates: the size of the keyed
+    # text the minimizers scan, the memory holding the values and the time
+    # to key the Django markup, run the html minimizers and put it back,
+    # checking both schemes put back the same minimized template.
+    import sys
+    import time
+    from _Benchmark import generate_corpus
+    from _ManageMinimizers import collapse_html_tags
+    from _TemplateTextMinimizer import tokenize_template, TEXT, COMMENT
+
+    RE_OLD_KEY = re.compile(r'_~\d+~_')
+
+    def old_keys(text):
+        word_list = []
+        pieces = []
+        for kind, value, start, end in tokenize_template(text):
+            if kind == TEXT:
+                pieces.append(value)
+            elif kind != COMMENT:
+                key = '_~%s~_' % len(word_list)
+                pieces.append(key)
+                word_list.append((key, value))
+        keyed = collapse_html_tags(''.join(pieces))
+        values = dict(word_list)
+        text = RE_OLD_KEY.sub(lambda match: values[match.group()], keyed)
+        return (keyed, word_list, text)
+
+    def old_size(word_list):
+        return sys.getsizeof(word_list) + sum(
+            [sys.getsizeof(x) + sys.getsizeof(x[0]) for x in word_list])
+
+    def new_keys(text):
+        keys = TemplateKeys(text)
+        pieces = []
+        for kind, value, start, end in tokenize_template(keys.escape(text)):
+            if kind == TEXT:
+                pieces.append(value)
+            elif kind != COMMENT:
+                pieces.append(keys.add(value))
+        keyed = collapse_html_tags(''.join(pieces))
+        text = keys.revert(keyed)
+        return (keyed, keys, text)
+
+    def new_size(keys):
+        return sys.getsizeof(keys.values) + sys.getsizeof(keys.literals)
+
+    texts = generate_corpus(50, 16 * 1024, tag_density=0.5, script_share=0,
+                            style_share=0)
+    schemes = (('_~%s~_', old_keys, old_size),
+               ('TemplateKeys', new_keys, new_size))
+    # Take turns so neither scheme gains from running later
+    best = {}
+    for i in xrange(5):
+        for name, f, size in schemes:
+            start = time.time()
+            for text in texts:
+                f(text)
+            elapsed = time.time() - start
+            best[name] = min(best.get(name, elapsed), elapsed)
+    print '%-14s %12s %12s %12s' % ('Per template', 'text bytes',
+                                    'store bytes', 'ms')
+    reverted = []
+    for name, f, size in schemes:
+        results = [f(text) for text in texts]
+        reverted.append([x[2] for x in results])
+        print '%-14s %12d %12d %12.3f' % (
+            name, sum([len(x[0]) for x in results]) / len(texts),
+            sum([size(x[1]) for x in results]) / len(texts),
+            best[name] * 1000 / len(texts))
+    print 'Same output: %d of %d' % (
+        len([x for x, y in zip(*reverted) if x == y]), len(texts))
@@ -23,7 +23,10 @@ OTHER DEALINGS IN THE SOFTWARE."""
 
 import re
 from _SimpleHTMLParser import get_first_tag_info
-from _ManageMinimizers import get_minimizers
+from _ManageMinimizers import MINIMIZERS, minimizer_names, html_cut
+from _ManageMinimizers import RE_RAW_TEXT
+from _TransferSize import gzip_size, brotli_size
+from _TemplateKeys import TemplateKeys
 
 FLAGS  = re.IGNORECASE + re.DOTALL
 
@@ -43,12 +46,103 @@ RE_DTAG    = re.compile(DTAG,    flags=FLAGS)
 RE_SCRIPT  = re.compile(SCRIPT,  flags=FLAGS)
 RE_STYLE   = re.compile(STYLE,   flags=FLAGS)
 
-# Will encasing the key in quotes. Will work well with javascript minifiers?
-KEY    = '_~%s~_'
-
-JSMINIMIZERS, CSSMINIMIZERS, HTMLMINIMIZERS = get_minimizers()
-
-def minimize_template_text(text):
+# The template is scanned once for Django markup.  NOMINIFY and COMMENT
+# blocks are matched whole.  Django variables, tags and one line comments
+# are split out of the rest of a line just as RE_REMOVE2, RE_DVAR and
+# RE_DTAG would split it.
+TOKENS  = (r'(?P<exclude>{#\s*NOMINIFY\s*#}(?P<exclude_data>.*?)'
+           r'{#\s*ENDNOMINIFY\s*#})|'
+           r'(?P<comment>{%\s*COMMENT\s*%})|'
+           r'(?P<django>{[{%#])')
+BLOCKS  = r'(?P<exclude>{#\s*NOMINIFY\s*#})|(?P<comment>{%\s*COMMENT\s*%})'
+ENDCOMMENT = (r'(?P<exclude>{#\s*NOMINIFY\s*#})|'
+              r'(?P<comment>{%\s*ENDCOMMENT\s*%})')
+NEWLINE = r'[\n\r]'
+
+RE_TOKENS     = re.compile(TOKENS,     flags=FLAGS)
+RE_BLOCKS     = re.compile(BLOCKS,     flags=FLAGS)
+RE_ENDCOMMENT = re.compile(ENDCOMMENT, flags=FLAGS)
+RE_NEWLINE    = re.compile(NEWLINE,    flags=FLAGS)
+
+# Find the last closing tag of each kind of block.  The leading .*
+# backtracks from the end of the text so only the tail is scanned.
+RE_LAST = {'exclude': re.compile(r'.*({#\s*ENDNOMINIFY\s*#})', flags=FLAGS),
+           'comment': re.compile(r'.*({%\s*ENDCOMMENT\s*%})',  flags=FLAGS)}
+
+# An opening script or style tag left over once the blocks are keyed
+OPEN_SCRIPT = r'<SCRIPT\b'
+OPEN_STYLE  = r'<STYLE\b'
+
+RE_OPEN_SCRIPT = re.compile(OPEN_SCRIPT, flags=FLAGS)
+RE_OPEN_STYLE  = re.compile(OPEN_STYLE,  flags=FLAGS)
+
+# Opening tags the compression aware html minimizer rewrites.  Tags with
+# Django markup between their attributes, which is keyed by then, do not
+# match.
+ATTR_NAME  = r'[A-Z_:][-A-Z0-9_:.]*'
+ATTR_VALUE = r'"[^"]*"|\'[^\']*\'|[^\s"\'=<>`]+'
+ATTRIBUTE  = r'\s+(%s)(?:\s*=\s*(%s))?' % (ATTR_NAME, ATTR_VALUE)
+OPEN_TAG   = r'<([A-Z][A-Z0-9]*)((?:\s+%s(?:\s*=\s*(?:%s))?)*)\s*(/?)>' % (
+    ATTR_NAME, ATTR_VALUE)
+
+RE_ATTRIBUTE = re.compile(ATTRIBUTE, flags=FLAGS)
+RE_OPEN_TAG  = re.compile(OPEN_TAG,  flags=FLAGS)
+RE_CLOSE_TAG = re.compile(r'</([A-Z][A-Z0-9]*)\s*>', flags=FLAGS)
+RE_VARIABLE_KEY_VALUE = re.compile(r'{{.*}}\Z', flags=FLAGS)
+
+# minimize_template_stream reads this many characters at a time and
+# minimizes at least this many at a time
+CHUNK_SIZE = 256 * 1024
+
+# A NOMINIFY block inside a template comment
+LOST_EXCLUDED = ('Minimizer failed to find all embeded variables.\n'
+                 'A NOMINIFY block is inside a template comment: %r')
+
+# Token kinds
+TEXT     = 'text'
+EXCLUDED = 'exclude'
+COMMENT  = 'comment'
+VARIABLE = 'variable'
+TAG      = 'tag'
+
+# The minimizer chains are read from the settings on first use; see
+# _ManageMinimizers.MinimizerRegistry
+TRANSFER_SIZE = {'gzip': gzip_size, 'brotli': brotli_size}
+
+# Optional instrumentation; see set_profiler
+PROFILER = None
+
+def set_profiler(profiler):
+    """Installs an object that is told about every stage of
+    minimize_template_text and every minimizer it calls.  Pass None to turn
+    profiling off.  A profiler has two methods:
+
+    begin(stage_name, text_in) -> mark
+    end(mark, text_out)
+
+    See _Profiler.Profiler."""
+    global PROFILER
+    PROFILER = profiler
+
+# Optional memo of minimized script and style blocks; see set_block_memo
+BLOCK_MEMO = None
+
+def set_block_memo(memo):
+    """Installs an object that remembers minimized script and style blocks
+    so that a block seen before is not minimized again.  Pass None to turn
+    it off.  A memo has two methods:
+
+    get(tag, data) -> minimized_block or None
+    set(tag, data, minimized_block)
+
+    See _MinimizerCache.BlockMemo."""
+    global BLOCK_MEMO
+    BLOCK_MEMO = memo
+
+def get_block_memo():
+    return BLOCK_MEMO
+
+def minimize_template_text(text, details=None, minimizers=None):
     """Takes a Django template text and returns a minified version.
 
     Performance is not critical as this function should be run off-line
@@ -65,150 +159,633 @@ def minimize_template_text(text):
     Use the {# NOMINIFY #} {# ENDNOMINIFY #} comment tags to wrap code you do
     not want minified.  Suggested uses include wrapping pre, code, and textarea
     html tags as well as the example above.
-    """
-
-    # Create a list to hold special values temporarily removed
-    # from the text.
-    # format -> [(key, value), ...]
-    word_list = []
-
-    # Remove Excluded text
-    excludes = RE_EXCLUDE.findall(text)
-
-    # Strip out the {# NOMINIFY #} and {# ENDNOMINIFY #} tags
-    excludes_find    = [''.join(x) for x in excludes]
-    excludes_replace = [x[1] for x in excludes]
-
-    # replace excluded text with keys and populate word_list
-    text = subsitute_text(text, word_list, KEY, excludes_find, excludes_replace)
-
-    # Remove any remaining template comments
-    text = RE_REMOVE.sub('', text)
-    text = RE_REMOVE2.sub('', text)
-
-    # We want to "protect" Django Vars and Tags
-    # then treat scripts and styles after "protecting" Django Vars and tags
-
-    # Extract Django Variables
-    dvars = RE_DVAR.findall(text)
-
-    # replace Django Variables text with keys and populate word_list
-    text = subsitute_text(text, word_list, KEY, dvars)
 
-    # Extract django tags
-    dtags = RE_DTAG.findall(text)
+    If the COMPRESSION_AWARE_HTML_MINIMIZER setting is on and a dictionary
+    is given as details, the sizes found by minimize_html_for_transfer are
+    saved in it.
 
-    # replace Django Tags text with keys and populate word_list
-    text = subsitute_text(text, word_list, KEY, dtags)
-
-    # Extract Styles
-    styles  = RE_STYLE.findall(text)
-
-    # Minimize syles
-    styles_replace = minimize_tag_data(styles) or None
-
-    # Put style pieces together
-    styles_find = [''.join(x) for x in styles]
+    minimizers is an optional dictionary of chains used in place of the
+    registered ones -> {'javascript': [...], 'css': [...], 'html': [...]}
+    Any of the keys may be left out.  The block memo is not used with them.
+    """
 
-    # replace styles with keys and populate word_list
-    text = subsitute_text(text, word_list, KEY, styles_find, styles_replace)
+    profiler = PROFILER
+    if profiler is not None:
+        mark = profiler.begin('template', text)
 
-    # Extract Scripts
-    scripts = RE_SCRIPT.findall(text)
+    chains = MINIMIZERS.get_chains(minimizers)
+    # The block memo only holds blocks minimized by the registered chains
+    block_chains = None
+    if minimizers:
+        block_chains = chains
 
-    # Put scripts pieces together
-    scripts_find = [''.join(x) for x in scripts]
+    # Holds special values temporarily removed from the text
+    keys = TemplateKeys(text)
 
-    # Minimize javascripts if requested
-    scripts_replace = minimize_tag_data(scripts) or None
+    # Replace excluded text, Django variables and Django tags with keys and
+    # populate keys.  Remove template comments.  Characters keys are made
+    # of are keyed first; see TemplateKeys.escape.
+    text = run_stage('django', substitute_django, keys.escape(text), keys)
 
-    # replace scripts with keys and populate word_list
-    text = subsitute_text(text, word_list, KEY, scripts_find, scripts_replace)
+    # Minimize styles, then scripts, and replace them with keys
+    text = run_stage('styles', substitute_blocks, text, keys, RE_STYLE,
+                     block_chains)
+    text = run_stage('scripts', substitute_blocks, text, keys, RE_SCRIPT,
+                     block_chains)
 
     # Run HTML Minimizers
-    for f in HTMLMINIMIZERS: text = f(text)
+    if MINIMIZERS.compression() is None:
+        text = run_stage('html', run_minimizers, text, chains['html'], 'html')
+    else:
+        text = run_stage('html', minimize_html_for_transfer, text, keys,
+                         details, chains['html'])
 
     # put values back into text
-    text = revert_text_keys(text, word_list)
+    text = run_stage('revert', keys.revert, text)
 
-    return text.strip()
+    text = text.strip()
+    if profiler is not None:
+        profiler.end(mark, text)
+    return text
 
-def revert_text_keys(text, word_list):
-    """ revert the text keys.  We may have to do this multiple times
-    as some keys may be embeded in other word_list entries"""
-    
-    if not text or not word_list: 
-        return text
+def run_stage(stage, f, text, *args):
+    """Returns f(text, *args), telling the profiler about it if one is
+    installed."""
+    profiler = PROFILER
+    if profiler is None:
+        return f(text, *args)
+    mark = profiler.begin(stage, text)
+    text = f(text, *args)
+    profiler.end(mark, text)
+    return text
 
-    # If we loop through the word_list 10 times without
-    #   consuming it completely, then something's probably wrong.
+def run_minimizers(text, minimizers, kind):
+    """Runs text through a chain of minimizers.  kind is 'javascript',
+    'css' or 'html' and names the minimizers for the profiler."""
+    if PROFILER is None:
+        for f in minimizers: text = f(text)
+        return text
+    for f in minimizers:
+        name = '%s:%s.%s' % (kind, getattr(f, '__module__', None),
+                             getattr(f, '__name__', f.__class__.__name__))
+        text = run_stage(name, f, text)
+    return text
 
-    max_iterations = len(word_list) * 10
+def minimize_html_for_transfer(text, keys, details=None,
+                               minimizers=None):
+    """Minimizes keyed html for the smallest compressed size instead of the
+    fewest bytes; used when the COMPRESSION_AWARE_HTML_MINIMIZER setting is
+    'gzip' or 'brotli'.
+
+    Each html minimizer, then normalize_tags, is tried in turn on the
+    text and kept only if the template compresses smaller with it.  The
+    result of the plain html minimizer chain is returned if it compresses
+    smaller still.  If details is a dictionary, the compression, the size
+    with the chain, the size of the result and the names of the steps kept
+    are saved in it.  minimizers is the html chain; the registered one by
+    default.
+    """
 
-    for x in xrange(max_iterations):
+    if minimizers is None:
+        minimizers = MINIMIZERS.get('html')
+    compression = MINIMIZERS.compression()
+    compress = TRANSFER_SIZE[compression]
+    def measure(text):
+        return compress(keys.revert(text).strip())
+
+    chain_text = run_minimizers(text, minimizers, 'html')
+    chain_size = measure(chain_text)
+
+    steps = zip(minimizer_names(minimizers), minimizers)
+    steps.append(('tags',
+                  lambda text: normalize_tags(text, keys)))
+    size = measure(text)
+    kept = []
+    for name, f in steps:
+        candidate = f(text)
+        if candidate == text:
+            continue
+        candidate_size = measure(candidate)
+        if (candidate_size, len(candidate)) < (size, len(text)):
+            text, size = candidate, candidate_size
+            kept.append(name)
+
+    if (chain_size, len(chain_text)) <= (size, len(text)):
+        text, size = chain_text, chain_size
+        kept = minimizer_names(minimizers)
+
+    if details is not None:
+        details.update({'compression': compression,
+                        'chain_size': chain_size, 'size': size, 'kept': kept})
+    return text
 
-        # When the wordlist empties, break the for loop
-        if not word_list:
-            break
+def normalize_tags(text, keys):
+    """Rewrites tags the same way so they compress better: names in lower
+    case, attributes sorted by name and values in double quotes.
+    Values with keys keep their quotes.  Tags with keys of anything but
+    Django variables are left alone, as sorting could move a Django tag
+    out of order.  So are pre, textarea and title elements, whose tags
+    may be text."""
+
+    def rewrite(match):
+        tag = match.group()
+        for key in keys.regex.findall(tag):
+            value = keys.lookup(key)
+            if value is not None and not RE_VARIABLE_KEY_VALUE.match(value):
+                return tag
+        attributes = []
+        for name, value in RE_ATTRIBUTE.findall(match.group(2)):
+            if value and not keys.regex.search(value):
+                if value[0] in ('"', "'"):
+                    value = value[1:-1]
+                if '"' in value:
+                    value = "'%s'" % value
+                else:
+                    value = '"%s"' % value
+            attributes.append((name.lower(), value))
+        # A stable sort; the first of two attributes of the same name wins
+        attributes.sort(key=lambda x: x[0])
+        pieces = [match.group(1).lower()]
+        for name, value in attributes:
+            pieces.append(value and '%s=%s' % (name, value) or name)
+        return '<%s%s>' % (' '.join(pieces), match.group(3))
+
+    def normalize(text):
+        text = RE_OPEN_TAG.sub(rewrite, text)
+        return RE_CLOSE_TAG.sub(lambda match: '</%s>' % match.group(1).lower(),
+                                text)
+
+    pieces = []
+    pos = 0
+    for match in RE_RAW_TEXT.finditer(text):
+        pieces.append(normalize(text[pos:match.start()]))
+        pieces.append(match.group())
+        pos = match.end()
+    pieces.append(normalize(text[pos:]))
+    return ''.join(pieces)
+
+def substitute_django(text, keys):
+    """Replaces excluded text, Django variables and Django tags with keys
+    in a single pass and removes template comments.  The values are saved in
+    keys."""
+    pieces = []
+    for kind, value, start, end in tokenize_template(text):
+        if kind == TEXT:
+            pieces.append(value)
+        elif kind != COMMENT:
+            pieces.append(keys.add(value))
+    return ''.join(pieces)
+
+def minimize_template_stream(stream, chunk_size=CHUNK_SIZE, minimizers=None):
+    """Minimizes a template read a chunk at a time and yields the minimized
+    text a piece at a time.  ''.join() of the pieces is the same as
+    minimize_template_text of the whole template.
+
+    stream is a file like object or an iterable of strings.
+
+    The template is cut at a line break once no NOMINIFY, COMMENT, style or
+    script block is left open before it, so only about chunk_size
+    characters are held at a time.  A block left open for good (a
+    {# NOMINIFY #} never closed, for example) holds everything after it
+    until the end of the template.  The HTML minimizers are assumed to only
+    change whitespace, as the default ones do.  minimizers is as for
+    minimize_template_text.
+    """
 
-        # Take the first entry off the list
-        key, value = word_list.pop(0)
+    chains = MINIMIZERS.get_chains(minimizers)
+    block_chains = None
+    if minimizers:
+        block_chains = chains
 
-        if key in text:
-            # Replace the key with the value
-            text = text.replace(key, value)
-        else:
-            # Put the entry back at the end of the list
-            word_list.append((key, value))
+    if hasattr(stream, 'read'):
+        chunks = iter(lambda: stream.read(chunk_size), '')
     else:
-        # We looped through too many time and
-        # never consumed the whole word_list
-        raise Exception('Minimizer failed to find all embeded variables.\n'
-                        '%s\n%s' % (word_list, text))
+        chunks = iter(stream)
+
+    # Values of the keys not yet put back.  Keys are numbered across the
+    # whole template; values are set to None once they are put back.
+    keys = None
+    # Keyed text held back until the next piece; see cut_keyed_text
+    carry = ''
+    # Whitespace held back in case it ends the template
+    pending = ''
+    started = False
+
+    pieces = []
+    size = 0
+    threshold = chunk_size
+    final = False
+    while not final:
+        try:
+            chunk = chunks.next()
+        except StopIteration:
+            final = True
+        else:
+            pieces.append(chunk)
+            size = size + len(chunk)
+            if size < threshold:
+                continue
+
+        text = ''.join(pieces)
+        if keys is None:
+            keys = TemplateKeys(text)
+        if final:
+            keyed = key_template_segment(text, keys, block_chains)
+            end = len(text)
+        else:
+            keyed, end = key_stream_segment(text, keys, block_chains)
+        pieces = [text[end:]]
+        size = len(pieces[0])
+        if keyed is None:
+            # No safe place to cut yet; wait for twice as much text
+            threshold = max(chunk_size, size * 2)
+            continue
+        threshold = chunk_size
+
+        keyed = carry + keyed
+        if final:
+            carry = ''
+        else:
+            keyed, carry = cut_keyed_text(keyed)
+        text = run_stage('html', run_minimizers, keyed, chains['html'],
+                         'html')
+        text = run_stage('revert', keys.pop, text)
+
+        # Strip the whole template, not each piece
+        if not started:
+            text = text.lstrip()
+            started = bool(text)
+        stripped = text.rstrip()
+        if stripped:
+            yield pending + stripped
+            pending = text[len(stripped):]
+        else:
+            pending = pending + text
 
+    missing = keys.missing()
+    if missing:
+        raise Exception('Minimizer failed to find all embeded variables.\n'
+                        '%s' % missing)
+
+def key_template_segment(text, keys, chains=None):
+    """Replaces the Django markup, styles and scripts in text with keys,
+    after the characters keys are made of; see TemplateKeys.escape.  See
+    minimize_tag_data for chains."""
+    text = run_stage('django', substitute_django, keys.escape(text), keys)
+    text = run_stage('styles', substitute_blocks, text, keys, RE_STYLE,
+                     chains)
+    text = run_stage('scripts', substitute_blocks, text, keys, RE_SCRIPT,
+                     chains)
     return text
 
-def subsitute_text(text, word_list, key_template,
-                   find_list, substitute_list=None):
-    """ Using the text provided, subsitutes the first occurance of each entry
-        in find_list with a key.  Store the key and value in the substitute_list
-        in the word_list.  If no substitute_list is provided, use the value in
-        the find list"""
-    if not substitute_list: substitute_list = find_list
+def key_stream_segment(text, keys, chains=None):
+    """Looks for a line break in text where the template can be cut and
+    keys the text up to it.  Returns (keyed_text, end) or (None, 0).
+
+    A cut is safe when minimizing the text before it gives the same keys as
+    minimizing the whole template would: every NOMINIFY and COMMENT block
+    opened before the cut is closed before it and no style or script block
+    is left open."""
+
+    # Try the last line break, then line breaks further back
+    tried = {}
+    for share in (4, 3, 2, 1):
+        end = max(text.rfind('\n', 0, len(text) * share // 4),
+                  text.rfind('\r', 0, len(text) * share // 4)) + 1
+        if end <= 0 or end in tried:
+            continue
+        tried[end] = True
+        segment = text[:end]
+
+        # Every NOMINIFY and COMMENT opening tag must be closed in the
+        # segment
+        cache = {}
+        last_exclude = -1
+        closed = True
+        for match in RE_BLOCKS.finditer(segment):
+            if match.lastgroup == 'exclude':
+                last_exclude = match.end()
+            elif comment_end(segment, match.end(), cache) < 0:
+                closed = False
+                break
+        if not closed or last_exclude > last_start(segment, 'exclude', cache):
+            continue
+
+        length = len(keys)
+        keyed = run_stage('django', substitute_django, keys.escape(segment),
+                          keys)
+
+        # No style or script may be left open once the blocks are keyed
+        styled = RE_STYLE.sub('_', keyed)
+        if RE_OPEN_STYLE.search(styled) or \
+           RE_OPEN_SCRIPT.search(RE_SCRIPT.sub('_', styled)):
+            keys.truncate(length)
+            continue
+
+        keyed = run_stage('styles', substitute_blocks, keyed, keys,
+                          RE_STYLE, chains)
+        keyed = run_stage('scripts', substitute_blocks, keyed, keys,
+                          RE_SCRIPT, chains)
+        return (keyed, end)
+
+    return (None, 0)
+
+def cut_keyed_text(text):
+    """Cuts keyed text where the HTML minimizers give the same result for
+    both sides as for the whole; see _ManageMinimizers.html_cut.  Never
+    cuts inside a key.  Returns (head, tail)."""
+    i = html_cut(text)
+    return (text[:i], text[i:])
+
+def tokenize_template(text):
+    """Scans a Django template once and yields its tokens ->
+    (kind, value, start, end)
+
+    kind is one of TEXT, EXCLUDED, COMMENT, VARIABLE or TAG.  The value of an
+    EXCLUDED token is the text between the {# NOMINIFY #} and
+    {# ENDNOMINIFY #} tags.  The value of a VARIABLE or TAG token is the
+    text it protects.  start and end are the offsets of the token in text.
+    """
 
-    values_list = zip(find_list, substitute_list)
+    # Offsets of the last closing tags in the text
+    # format -> {block_name: start, ...}
+    last = {}
 
-    for find, substitute in values_list:
-        key = key_template % len(word_list)
-        text = text.replace(find, key, 1)
-        word_list.append((key, substitute))
+    pos = 0
+    while True:
+        match = RE_TOKENS.search(text, pos)
+        if not match:
+            break
+        start, end = match.span()
+        if start > pos:
+            yield (TEXT, text[pos:start], pos, start)
+
+        kind = match.lastgroup
+        if kind == 'comment':
+            end = comment_end(text, match.end(), last)
+        if kind == 'exclude':
+            yield (EXCLUDED, match.group('exclude_data'), start, end)
+        elif kind == 'comment' and end >= 0:
+            check_comment(text[start:end])
+            yield (COMMENT, text[start:end], start, end)
+        else:
+            segments, end = get_line_segments(text, start, last)
+            for token in split_line_segments(segments):
+                yield token
+        pos = end
 
-    return text
+    if pos < len(text):
+        yield (TEXT, text[pos:], pos, len(text))
+
+def get_line_segments(text, pos, last):
+    """Returns the rest of the line starting at pos as a list of segments ->
+    ([(kind, value, start, end), ...], line_end)
 
-def minimize_tag_data(tags):
+    A NOMINIFY or COMMENT block does not end the line; the line carries on
+    after the block as it would once the block is taken out of the text.
+    kind is TEXT, EXCLUDED or COMMENT.
+    """
+
+    segments = []
+    while True:
+        line_end = len(text)
+        match = RE_NEWLINE.search(text, pos)
+        if match:
+            line_end = match.start()
+
+        # Look for a NOMINIFY or COMMENT block that is closed later on
+        segment = None
+        for match in RE_BLOCKS.finditer(text, pos, line_end):
+            start = match.start()
+            if match.lastgroup == 'exclude':
+                if last_start(text, 'exclude', last) >= match.end():
+                    block = RE_EXCLUDE.match(text, start)
+                    segment = (EXCLUDED, block.group(2)) + block.span()
+                    break
+            else:
+                end = comment_end(text, match.end(), last)
+                if end >= 0:
+                    check_comment(text[start:end])
+                    segment = (COMMENT, text[start:end], start, end)
+                    break
+
+        if not segment:
+            segments.append((TEXT, text[pos:line_end], pos, line_end))
+            return (segments, line_end)
+
+        if segment[2] > pos:
+            segments.append((TEXT, text[pos:segment[2]], pos, segment[2]))
+        segments.append(segment)
+        pos = segment[3]
+
+def split_line_segments(segments):
+    """Splits a line of segments into TEXT, EXCLUDED, COMMENT, VARIABLE and
+    TAG tokens.  Comments are taken out first and variables are found before
+    tags, so the greedy RE_REMOVE2, RE_DVAR and RE_DTAG patterns split the
+    line the same way they would when run over the whole template one after
+    another."""
+
+    # Lay the segments out on the line the way the patterns would see it.
+    # An excluded block is one character standing in for its key.  A
+    # comment block has already been taken out and takes no room.
+    # format -> [(line_start, line_end, kind, value, start, end), ...]
+    units = []
+    line = []
+    length = 0
+    for kind, value, start, end in segments:
+        width = 0
+        if kind == TEXT:
+            width = len(value)
+            line.append(value)
+        elif kind == EXCLUDED:
+            width = 1
+            line.append('_')
+        units.append((length, length + width, kind, value, start, end))
+        length = length + width
+    line = ''.join(line)
+
+    comment = RE_REMOVE2.search(line)
+    removed = line
+    if comment:
+        removed = line[:comment.start()] + line[comment.end():]
+
+    def line_span(match):
+        # Maps a match in the line without the comment back onto the line
+        start, end = match.span()
+        if comment:
+            width = comment.end() - comment.start()
+            if start >= comment.start():
+                start = start + width
+            if end > comment.start():
+                end = end + width
+        return (start, end)
+
+    # format -> [(start, end, kind), ...]
+    spans = []
+    dvar = RE_DVAR.search(removed)
+    if dvar:
+        spans.append(line_span(dvar) + (VARIABLE,))
+        # Hide the variable from the tag pattern the way a key would
+        start, end = dvar.span()
+        removed = removed[:start] + '_' * (end - start) + removed[end:]
+    dtag = RE_DTAG.search(removed)
+    if dtag:
+        start, end = line_span(dtag)
+        # A tag that encloses the variable protects it as well
+        spans = [x for x in spans if not (start <= x[0] and x[1] <= end)]
+        spans.append((start, end, TAG))
+
+    # Cut the text segments where the comment and spans start and end
+    cuts = [x for span in spans for x in span[:2]]
+    if comment:
+        cuts.extend(comment.span())
+    cuts.sort()
+    pieces = []
+    for line_start, line_end, kind, value, start, end in units:
+        if kind == TEXT:
+            for cut in cuts:
+                if line_start < cut < line_end:
+                    width = cut - line_start
+                    pieces.append((line_start, cut, kind, value[:width],
+                                   start, start + width))
+                    line_start, value, start = cut, value[width:], start + width
+        pieces.append((line_start, line_end, kind, value, start, end))
+
+    def covers(span, line_start, line_end):
+        if line_start == line_end:
+            return span[0] <= line_start < span[1]
+        return span[0] <= line_start and line_end <= span[1]
+
+    # format -> [kind, [value, ...], start, end, span]
+    protected = None
+    for line_start, line_end, kind, value, start, end in pieces:
+        span = None
+        for x in spans:
+            if covers(x, line_start, line_end):
+                span = x
+
+        if protected and protected[4] is not span:
+            yield (protected[0], ''.join(protected[1])) + tuple(protected[2:4])
+            protected = None
+
+        if comment and covers(comment.span(), line_start, line_end):
+            if kind == EXCLUDED:
+                raise Exception(LOST_EXCLUDED % value)
+            if not span:
+                yield (COMMENT, value, start, end)
+        elif span:
+            if not protected:
+                protected = [span[2], [], start, end, span]
+            if kind != COMMENT:
+                protected[1].append(value)
+            protected[3] = end
+        elif value or kind != TEXT:
+            yield (kind, value, start, end)
+
+    if protected:
+        yield (protected[0], ''.join(protected[1])) + tuple(protected[2:4])
+
+def check_comment(comment):
+    """Raises if a NOMINIFY block is inside the comment, as the text it
+    protects would be removed with the comment."""
+    block = RE_EXCLUDE.search(comment)
+    if block:
+        raise Exception(LOST_EXCLUDED % block.group(2))
+
+def last_start(text, name, cache):
+    """Returns the offset of the last closing tag of a NOMINIFY ('exclude')
+    or COMMENT ('comment') block in text or -1.  Results are saved in the
+    cache dictionary."""
+    if name not in cache:
+        cache[name] = -1
+        match = RE_LAST[name].match(text)
+        if match:
+            cache[name] = match.start(1)
+    return cache[name]
+
+def comment_end(text, pos, cache):
+    """Returns the end offset of the COMMENT block whose opening tag ends
+    at pos or -1 if the block is never closed.  NOMINIFY blocks are taken
+    out of the text before COMMENT blocks, so a closing tag inside a
+    NOMINIFY block does not close the COMMENT block."""
+    while last_start(text, 'comment', cache) >= pos:
+        match = RE_ENDCOMMENT.search(text, pos)
+        if not match:
+            return -1
+        if match.lastgroup == 'comment':
+            return match.end()
+        pos = match.end()
+        if last_start(text, 'exclude', cache) >= pos:
+            pos = RE_EXCLUDE.match(text, match.start()).end()
+    return -1
+
+def substitute_blocks(text, keys, regex, chains=None):
+    """Replaces each script or style block found by regex with a key in a
+    single pass.  The blocks are minimized and saved in keys.  See
+    minimize_tag_data for chains."""
+
+    spans = [match.span() + (minimize_tag_data([match.groups()], chains)[0],)
+             for match in regex.finditer(text)]
+
+    return substitute_spans(text, keys, spans)
+
+def substitute_spans(text, keys, spans):
+    """Replaces each (start, end, value) span of text with a key and stores
+    the value in keys.  Spans must be in order and must not overlap.  The
+    new text is built in a single join."""
+
+    pieces = []
+    pos = 0
+    for start, end, value in spans:
+        pieces.append(text[pos:start])
+        pieces.append(keys.add(value))
+        pos = end
+    pieces.append(text[pos:])
+
+    return ''.join(pieces)
+
+def minimize_tag_data(tags, chains=None):
     """ This minimizes data in certain tags.
     Currently <script>Javascript</script> and <style>css</style>.
     Function assumes script is javascript if no type is specified.
     Function also assumes style is css if no type is specified.
+    chains are the minimizer chains to use instead of the registered ones;
+    see MinimizerRegistry.get_chains.  The block memo is only used with the
+    registered chains.
     """
 
     retval = []
+    memo = BLOCK_MEMO
+    if chains is None:
+        chains = MINIMIZERS.get_chains()
+    else:
+        memo = None
 
     for tag, data, end_tag in tags:
 
+        if memo is not None:
+            block = memo.get(tag, data)
+            if block is not None:
+                retval.append(block + end_tag)
+                continue
+            original = data
+
         tag_name, attr = get_first_tag_info(tag)
         type_attr = attr.get('type', 'javascript')
 
         if tag_name == 'script':
             type_attr = attr.get('type', 'javascript')
             if 'javascript' in type_attr:
-                for f in JSMINIMIZERS: data = f(data)
+                data = run_minimizers(data, chains['javascript'],
+                                      'javascript')
 
         if tag_name == 'style':
             type_attr = attr.get('type', 'css')
             if 'css' in type_attr:
-                for f in CSSMINIMIZERS: data = f(data)
+                data = run_minimizers(data, chains['css'], 'css')
 
+        if memo is not None:
+            memo.set(tag, original, tag + data)
         retval.append(tag + data + end_tag)
 
     return retval
@@ -412,3 +989,54 @@ here \t\t\tcomes        the rain \n\n\nagain <a href='bla'>test</a>
     print '#' * 10
     print 'Character length before: %s' % len(text)
     print 'Character length after:  %s' % len(a)
+
+    # Compare the single pass tokenizer with the substitution passes it
+    # replaced, one regular expression per construct, over a fixed corpus
+    # and the templates named on the command line.
+    # usage: python _TemplateTextMinimizer.py [template ...]
+    import sys, random
+
+    def substitute_passes(text, keys):
+        text = RE_EXCLUDE.sub(lambda match: keys.add(match.group(2)), text)
+        text = RE_REMOVE.sub('', text)
+        text = RE_REMOVE2.sub('', text)
+        text = RE_DVAR.sub(lambda match: keys.add(match.group()), text)
+        return RE_DTAG.sub(lambda match: keys.add(match.group()), text)
+
+    def minimize_passes(text):
+        keys = TemplateKeys(text)
+        text = substitute_passes(keys.escape(text), keys)
+        text = substitute_blocks(text, keys, RE_STYLE)
+        text = substitute_blocks(text, keys, RE_SCRIPT)
+        text = run_minimizers(text, MINIMIZERS.get('html'), 'html')
+        if not text and len(keys.values) > len(keys.literals):
+            # revert leaves an empty text alone, so the values lost with the
+            # comments that took the whole text would go unnoticed
+            raise Exception('Minimizer failed to find all embeded variables.')
+        return keys.revert(text).strip()
+
+    def result(f, text):
+        # Both fail when a NOMINIFY block is lost with a comment
+        try:
+            return f(text)
+        except Exception, e:
+            return 'failed: %s' % str(e).split('\n')[0]
+
+    parts = ['{# NOMINIFY #}', '{# ENDNOMINIFY #}', '{% comment %}',
+             '{% endcomment %}', '{#', '#}', '{# note #}', '{{', '}}',
+             '{{ value|default:"a  b" }}', '{%', '%}', '{% if a %}',
+             '{% url "view" %}', '<pre>  a  </pre>', '<a title="x  y">',
+             '<script> var  a = 1; </script>', '<style> p { } </style>',
+             'text   here', '  ', '\n', '\r\n', '<p>', '</p>']
+    rnd = random.Random(0)
+    corpus = [text] + [''.join(rnd.choice(parts)
+                               for i in xrange(rnd.randint(1, 60)))
+                       for n in xrange(5000)]
+    corpus.extend([open(name, 'rb').read() for name in sys.argv[1:]])
+    differ = [x for x in corpus
+              if result(minimize_template_text, x) !=
+                 result(minimize_passes, x)]
+    print 'Same results as the substitution passes: %s of %s templates' % (
+        len(corpus) - len(differ), len(corpus))
+    for x in differ[:5]:
+        print repr(x)
@@ -0,0 +1,138 @@
+"""Copyright (c) 2012 Charles Kaminski (CharlesKaminski@gmail.com)
+
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE."""
+
+from os import walk, stat
+from os.path import join
+from time import time, sleep
+
+try:
+    import pyinotify
+except ImportError:
+    # Optional; directories are polled without it
+    pyinotify = None
+
+POLL_INTERVAL = 1.0 # Seconds between scans of the directories when polling
+DEBOUNCE = 0.2 # Seconds without a change that end a burst of changes
+
+class PollingWatcher(object):
+    """Finds changed files by walking the directories every interval
+    seconds and comparing the modification times and sizes of the files."""
+
+    def __init__(self, dirs, interval=POLL_INTERVAL):
+        self.dirs = dirs
+        self.interval = interval
+        self.files = self.scan()
+
+    def scan(self):
+        """Returns -> {path: (modification_time, size), ...}"""
+        files = {}
+        for d in self.dirs:
+            for root, walk_dirs, names in walk(d):
+                for name in names:
+                    path = join(root, name)
+                    try:
+                        info = stat(path)
+                    except OSError:
+                        # Removed while walking
+                        continue
+                    files[path] = (info.st_mtime, info.st_size)
+        return files
+
+    def changes(self, timeout=None):
+        """Returns the paths of the files created, changed or removed since
+        the last call -> set
+
+        Waits until there is a change, or for at most timeout seconds."""
+        start = time()
+        while True:
+            wait = self.interval
+            if timeout is not None:
+                wait = min(wait, max(start + timeout - time(), 0))
+            sleep(wait)
+            files = self.scan()
+            paths = set([path for path in files
+                         if self.files.get(path) != files[path]])
+            paths.update([path for path in self.files if path not in files])
+            self.files = files
+            if paths or timeout is not None and time() >= start + timeout:
+                return paths
+
+class InotifyWatcher(object):
+    """Finds changed files with inotify, through the pyinotify module.
+    Directories created later are watched as well."""
+
+    def __init__(self, dirs):
+        mask = (pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO |
+                pyinotify.IN_MOVED_FROM | pyinotify.IN_DELETE |
+                pyinotify.IN_CREATE)
+        self.paths = set()
+        paths = self.paths
+
+        class Handler(pyinotify.ProcessEvent):
+            def process_default(self, event):
+                if not event.dir:
+                    paths.add(event.pathname)
+
+        self.manager = pyinotify.WatchManager()
+        self.notifier = pyinotify.Notifier(self.manager, Handler())
+        self.manager.add_watch(dirs, mask, rec=True, auto_add=True)
+
+    def changes(self, timeout=None):
+        """See PollingWatcher.changes."""
+        if timeout is not None:
+            deadline = time() + timeout
+        while not self.paths:
+            milliseconds = None
+            if timeout is not None:
+                milliseconds = int((deadline - time()) * 1000)
+                if milliseconds <= 0:
+                    break
+            if self.notifier.check_events(milliseconds):
+                self.notifier.read_events()
+                self.notifier.process_events()
+        paths = set(self.paths)
+        self.paths.clear()
+        return paths
+
+    def close(self):
+        self.notifier.stop()
+
+def get_watcher(dirs, interval=POLL_INTERVAL):
+    """Returns an InotifyWatcher if pyinotify is installed, or else a
+    PollingWatcher."""
+    if pyinotify is not None:
+        return InotifyWatcher(dirs)
+    return PollingWatcher(dirs, interval)
+
+def watch(watcher, callback, debounce=DEBOUNCE):
+    """Calls callback with the sorted paths changed in each burst of
+    changes, once no change has been seen for debounce seconds, so a save
+    that writes several files is handled once.  Runs until interrupted."""
+    while True:
+        paths = watcher.changes()
+        while True:
+            more = watcher.changes(debounce)
+            if not more:
+                break
+            paths.update(more)
+        callback(sorted(paths))
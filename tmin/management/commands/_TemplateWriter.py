@@ -0,0 +1,348 @@
+"""Copyright (c) 2012 Charles Kaminski (CharlesKaminski@gmail.com)
+
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE."""
+
+import os
+from os import makedirs, remove, rename, fsync
+from os.path import join, exists, dirname
+from shutil import move, rmtree
+from hashlib import sha1
+from fnmatch import fnmatch
+from multiprocessing.pool import ThreadPool
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+STAGING = '_minimizer_staging'
+JOURNAL = 'journal'
+MANIFEST = '_minimizer_manifest.json'
+WRITE_THREADS = 8 # Threads writing and renaming files
+FSYNC_BATCH = 32 # Files written by a thread before they are synced
+
+class ManifestError(Exception):
+    pass
+
+class TemplateWriter(object):
+    """Replaces the templates of one template directory with their
+    minimized text, moving the originals to the archive directory, so that
+    a crash at any point can be resumed or rolled back.
+
+    1. Every minimized template is written to the staging directory by a
+       pool of threads.  Each thread syncs the files it wrote in batches.
+    2. A journal listing every template, its staged file and the hashes of
+       the original and minimized text is written and synced.
+    3. Each original is hard linked into the archive (moved where links
+       are not available) and the staged file is renamed over it, so the
+       template is replaced atomically.
+    4. A manifest of the archived templates is written to the archive
+       directory, the directories are synced and the staging directory is
+       removed.  A run over several template directories removes the
+       staging directories only once every directory is done, so an
+       interrupted run is resumed or rolled back as a whole.
+
+    Whether a template was replaced is read from the files themselves: the
+    archive copy exists once step 3 has started and the staged file is
+    gone once it is done.  So resume() finishes steps 3 and 4 and
+    rollback() puts the originals back, however far a run got.
+
+    Templates are named by their path relative to the template directory
+    with '/' separators, as the template loaders name them.
+    """
+
+    def __init__(self, directory, archive_dir, threads=WRITE_THREADS,
+                 batch_size=FSYNC_BATCH):
+        self.directory = directory
+        self.archive_dir = archive_dir
+        self.staging_dir = join(directory, STAGING)
+        self.journal_path = join(self.staging_dir, JOURNAL)
+        self.threads = threads
+        self.batch_size = batch_size
+
+    def path(self, name):
+        return join(self.directory, *name.split('/'))
+
+    def archive_path(self, name):
+        return join(self.archive_dir, *name.split('/'))
+
+    def pending(self):
+        """Returns True if a run was interrupted and left a journal."""
+        return exists(self.journal_path)
+
+    def write(self, writes):
+        """Replaces templates.  writes -> [(template_name, text), ...]"""
+        self.commit(self.stage(writes))
+
+    def stage(self, writes):
+        """Writes the staged files and the journal; steps 1 and 2.  Returns
+        the journal entries.  Call commit, or resume, to replace the
+        templates."""
+        if exists(self.staging_dir):
+            rmtree(self.staging_dir)
+        makedirs(self.staging_dir)
+        files = [(self.path(name), join(self.staging_dir, str(i)), text)
+                 for i, (name, text) in enumerate(writes)]
+        batches = [files[i:i + self.batch_size]
+                   for i in xrange(0, len(files), self.batch_size)]
+        hashes = []
+        for batch_hashes in self.map(write_batch, batches):
+            hashes.extend(batch_hashes)
+        fsync_dir(self.staging_dir)
+
+        # format -> [(template_name, staged_path, original_sha1,
+        #             minimized_sha1), ...]
+        entries = []
+        for (name, text), (path, staged, x), original_hash in zip(writes,
+                                                                 files,
+                                                                 hashes):
+            entries.append((name, staged, original_hash,
+                            sha1(text).hexdigest()))
+        write_json(self.journal_path, {'entries': entries})
+        return entries
+
+    def resume(self, finish=True):
+        """Finishes replacing the templates of an interrupted run.  See
+        commit for finish."""
+        self.commit(read_journal(self.journal_path), finish)
+
+    def rollback(self):
+        """Puts back the originals of an interrupted run and removes the
+        archive directory."""
+        entries = read_journal(self.journal_path)
+        paths = []
+        for entry in entries:
+            path, archive_path = self.path(entry[0]), self.archive_path(entry[0])
+            if exists(archive_path):
+                if exists(path):
+                    remove(path)
+                rename(archive_path, path)
+            paths.append(path)
+        fsync_dirs([dirname(x) for x in paths])
+        if exists(self.archive_dir):
+            rmtree(self.archive_dir)
+        rmtree(self.staging_dir)
+
+    def commit(self, entries, finish=True):
+        """Replaces the templates; steps 3 and 4.  If finish is False the
+        staging directory and its journal are kept, so the run can still be
+        rolled back, until finish() is called."""
+        replacements = [(self.path(name), self.archive_path(name), staged)
+                        for name, staged, original_hash, minimized_hash
+                        in entries]
+        archive_dirs = {}
+        for path, archive_path, staged in replacements:
+            archive_dirs[dirname(archive_path)] = True
+        for d in sorted(archive_dirs):
+            if not exists(d):
+                makedirs(d)
+
+        self.map(replace_template, replacements)
+
+        manifest = {}
+        for name, staged, original_hash, minimized_hash in entries:
+            manifest[name] = {'original_sha1': original_hash,
+                              'minimized_sha1': minimized_hash}
+        write_manifest(self.archive_dir, manifest)
+
+        fsync_dirs(archive_dirs.keys() +
+                   [dirname(path) for path, archive_path, staged
+                    in replacements])
+        if finish:
+            self.finish()
+
+    def finish(self):
+        """Removes the staging directory and its journal once the templates
+        are replaced.  The run can no longer be resumed or rolled back."""
+        rmtree(self.staging_dir)
+
+    def verify(self, patterns=None):
+        """Checks the archived originals of the templates whose names match
+        one of the shell style patterns, or of every template, against the
+        manifest.  ManifestError is raised if one is missing or damaged.
+
+        Returns (names, changed_names); changed templates were edited after
+        they were minimized.
+        """
+        manifest = read_manifest(self.archive_dir)
+        if manifest is None:
+            raise ManifestError('No manifest in %s' % self.archive_dir)
+        names = sorted([name for name in manifest if not patterns or
+                        [p for p in patterns if fnmatch(name, p)]])
+
+        def check(name):
+            return (file_hash(self.archive_path(name)) ==
+                    manifest[name]['original_sha1'],
+                    file_hash(self.path(name)) ==
+                    manifest[name]['minimized_sha1'])
+        checks = self.map(check, names)
+        damaged = [name for name, (ok, same) in zip(names, checks) if not ok]
+        if damaged:
+            raise ManifestError('These archived templates are missing or do '
+                                'not match the manifest:\n%s' %
+                                '\n'.join(damaged))
+        changed = [name for name, (ok, same) in zip(names, checks)
+                   if not same]
+        return (names, changed)
+
+    def restore(self, reverted_dir, names):
+        """Puts back the archived originals of the named templates; see
+        verify.  The templates they replace are moved to reverted_dir.  The
+        archive directory is removed once it is empty."""
+
+        def restore(name):
+            path = self.path(name)
+            if exists(path):
+                reverted_path = join(reverted_dir, *name.split('/'))
+                make_dirs(dirname(reverted_path))
+                move(path, reverted_path)
+            make_dirs(dirname(path))
+            move(self.archive_path(name), path)
+        self.map(restore, names)
+
+        manifest = read_manifest(self.archive_dir)
+        for name in names:
+            del manifest[name]
+        if manifest:
+            write_manifest(self.archive_dir, manifest)
+        else:
+            rmtree(self.archive_dir)
+
+    def map(self, f, items):
+        if self.threads > 1 and len(items) > 1:
+            pool = ThreadPool(min(self.threads, len(items)))
+            try:
+                return pool.map(f, items)
+            finally:
+                pool.close()
+                pool.join()
+        return map(f, items)
+
+def write_batch(batch):
+    """Writes a batch of (original_path, staged_path, text) and syncs the
+    staged files together.  Returns the hashes of the originals."""
+    hashes = []
+    files = []
+    try:
+        for path, staged, text in batch:
+            hashes.append(file_hash(path))
+            f = open(staged, 'wb')
+            files.append(f)
+            f.write(text)
+            f.flush()
+        for f in files:
+            fsync(f.fileno())
+    finally:
+        for f in files:
+            f.close()
+    return hashes
+
+def replace_template(replacement):
+    """Archives a template and renames its staged replacement over it.
+    Does nothing if that was done already."""
+    path, archive_path, staged = replacement
+    if not exists(staged):
+        return
+    if not exists(archive_path):
+        if hasattr(os, 'link'):
+            # The template is never missing
+            os.link(path, archive_path)
+        else:
+            move(path, archive_path)
+    elif exists(path) and os.name == 'nt':
+        # rename does not replace files on Windows
+        remove(path)
+    rename(staged, path)
+
+def file_hash(path):
+    """Returns the sha1 hex digest of a file or None if it is missing."""
+    try:
+        f = open(path, 'rb')
+    except IOError:
+        return None
+    try:
+        return sha1(f.read()).hexdigest()
+    finally:
+        f.close()
+
+def make_dirs(d):
+    if not exists(d):
+        try:
+            makedirs(d)
+        except OSError:
+            # Another thread created it first
+            pass
+
+def read_manifest(archive_dir):
+    """Returns the manifest of an archive directory or None.
+    format -> {template_name: {'original_sha1': hex_digest,
+                               'minimized_sha1': hex_digest}, ...}"""
+    path = join(archive_dir, MANIFEST)
+    if not exists(path):
+        return None
+    return json.load(open(path, 'rb'))['templates']
+
+def write_manifest(archive_dir, manifest):
+    write_json(join(archive_dir, MANIFEST), {'templates': manifest})
+
+def read_journal(path):
+    return [tuple(entry) for entry in json.load(open(path, 'rb'))['entries']]
+
+def write_json(path, value):
+    """Writes value to path as JSON atomically and syncs it."""
+    write_file(path, json.dumps(value))
+
+def write_file(path, text, sync=True):
+    """Writes text to path atomically; readers see the old or the new text,
+    never part of it.  The file is synced if sync is True."""
+    temp_path = path + '.tmp'
+    f = open(temp_path, 'wb')
+    try:
+        f.write(text)
+        if sync:
+            f.flush()
+            fsync(f.fileno())
+    finally:
+        f.close()
+    if exists(path) and os.name == 'nt':
+        remove(path)
+    rename(temp_path, path)
+    if sync:
+        fsync_dir(dirname(path))
+
+def fsync_dirs(dirs):
+    for d in sorted(set(dirs)):
+        fsync_dir(d)
+
+def fsync_dir(d):
+    """Syncs a directory so the renames in it are on disk.  Not possible on
+    every platform."""
+    try:
+        fd = os.open(d, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -0,0 +1,57 @@
+"""Copyright (c) 2012 Charles Kaminski (CharlesKaminski@gmail.com)
+
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE."""
+
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    # Optional; brotli sizes are reported as None without it
+    brotli = None
+
+GZIP_LEVEL = 6 # The level most web servers use
+GZIP_OVERHEAD = 18 # Bytes of gzip header and trailer around the data
+
+def gzip_size(text, level=GZIP_LEVEL):
+    """Returns the size of text in bytes once gzipped."""
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    data = compressor.compress(text) + compressor.flush()
+    return len(data) + GZIP_OVERHEAD
+
+def brotli_size(text):
+    """Returns the size of text in bytes once compressed with brotli or
+    None if the brotli module is not installed."""
+    if brotli is None:
+        return None
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return len(brotli.compress(text))
+
+def transfer_sizes(text):
+    """Returns {'bytes': size, 'gzip': size, 'brotli': size_or_None}"""
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return {'bytes': len(text), 'gzip': gzip_size(text),
+            'brotli': brotli_size(text)}
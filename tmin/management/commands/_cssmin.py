@@ -80,9 +80,31 @@ import re
 __version__ = '0.1.4'
 
 
+# Patterns are compiled once, when the module is imported.
+RE_PSEUDOCLASSCOLON = re.compile(r"(^|\})(([^\{\:])+\:)+([^\{]*\{)")
+RE_SPACE_BEFORE = re.compile(r"\s+([!{};:>+\(\)\],])")
+RE_CHARSET_FIRST = re.compile(r"^(.*)(@charset \"[^\"]*\";)")
+RE_CHARSET_ONCE = re.compile(r"^(\s*@charset [^;]+;\s*)+")
+RE_AND_PAREN = re.compile(r"\band\(")
+RE_SPACE_AFTER = re.compile(r"([!{}:;>+\(\[,])\s+")
+RE_SEMICOLONS_BRACE = re.compile(r";+\}")
+RE_EMPTY_RULES = re.compile(r"[^\}\{]+\{\}")
+RE_RGB = re.compile(r"rgb\s*\(\s*([0-9,\s]+)\s*\)")
+RE_ZERO_UNITS = re.compile(r"([\s:])(0)(px|em|%|in|cm|mm|pc|pt|ex)")
+RE_MULTIDIMENSIONAL_ZEROS = re.compile(r"(background-position)?:0(?: 0){1,3};")
+RE_FLOATING_POINTS = re.compile(r"(:|\s)0+\.(\d+)")
+RE_HEX_COLORS = re.compile(r"([^\"'=\s])(\s*)#([0-9a-fA-F])([0-9a-fA-F])([0-9a-fA-F])([0-9a-fA-F])([0-9a-fA-F])([0-9a-fA-F])")
+RE_WHITESPACE = re.compile(r"\s+")
+RE_SEMICOLONS = re.compile(r";;+")
+
+
 def remove_comments(css):
     """Remove all CSS comment blocks."""
 
+    # Kept text is appended to `out`; `pos` is where the next kept text
+    # starts.
+    out = []
+    pos = 0
     iemac = False
     preserve = False
     comment_start = css.find("/*")
@@ -94,24 +116,23 @@ def remove_comments(css):
         comment_end = css.find("*/", comment_start + 2)
         if comment_end < 0:
             if not preserve:
-                css = css[:comment_start]
-                break
-        elif comment_end >= (comment_start + 2):
-            if css[comment_end - 1] == "\\":
-                # This is an IE Mac-specific comment; leave this one and the
-                # following one alone.
-                comment_start = comment_end + 2
-                iemac = True
-            elif iemac:
-                comment_start = comment_end + 2
-                iemac = False
-            elif not preserve:
-                css = css[:comment_start] + css[comment_end + 2:]
-            else:
-                comment_start = comment_end + 2
-        comment_start = css.find("/*", comment_start)
-
-    return css
+                out.append(css[pos:comment_start])
+                pos = len(css)
+            # An unterminated `/*!` comment is kept.
+            break
+        elif css[comment_end - 1] == "\\":
+            # This is an IE Mac-specific comment; leave this one and the
+            # following one alone.
+            iemac = True
+        elif iemac:
+            iemac = False
+        elif not preserve:
+            out.append(css[pos:comment_start])
+            pos = comment_end + 2
+        comment_start = css.find("/*", comment_end + 2)
+
+    out.append(css[pos:])
+    return ''.join(out)
 
 
 def remove_unnecessary_whitespace(css):
@@ -126,33 +147,27 @@ def remove_unnecessary_whitespace(css):
         translated back again later.
         """
 
-        regex = re.compile(r"(^|\})(([^\{\:])+\:)+([^\{]*\{)")
-        match = regex.search(css)
-        while match:
-            css = ''.join([
-                css[:match.start()],
-                match.group().replace(":", "___PSEUDOCLASSCOLON___"),
-                css[match.end():]])
-            match = regex.search(css)
-        return css
+        return RE_PSEUDOCLASSCOLON.sub(
+            lambda match: match.group().replace(":", "___PSEUDOCLASSCOLON___"),
+            css)
 
     css = pseudoclasscolon(css)
     # Remove spaces from before things.
-    css = re.sub(r"\s+([!{};:>+\(\)\],])", r"\1", css)
+    css = RE_SPACE_BEFORE.sub(r"\1", css)
 
     # If there is a `@charset`, then only allow one, and move to the beginning.
-    css = re.sub(r"^(.*)(@charset \"[^\"]*\";)", r"\2\1", css)
-    css = re.sub(r"^(\s*@charset [^;]+;\s*)+", r"\1", css)
+    css = RE_CHARSET_FIRST.sub(r"\2\1", css)
+    css = RE_CHARSET_ONCE.sub(r"\1", css)
 
     # Put the space back in for a few cases, such as `@media screen` and
     # `(-webkit-min-device-pixel-ratio:0)`.
-    css = re.sub(r"\band\(", "and (", css)
+    css = RE_AND_PAREN.sub("and (", css)
 
     # Put the colons back.
     css = css.replace('___PSEUDOCLASSCOLON___', ':')
 
     # Remove spaces from after things.
-    css = re.sub(r"([!{}:;>+\(\[,])\s+", r"\1", css)
+    css = RE_SPACE_AFTER.sub(r"\1", css)
 
     return css
 
@@ -160,42 +175,41 @@ def remove_unnecessary_whitespace(css):
 def remove_unnecessary_semicolons(css):
     """Remove unnecessary semicolons."""
 
-    return re.sub(r";+\}", "}", css)
+    return RE_SEMICOLONS_BRACE.sub("}", css)
 
 
 def remove_empty_rules(css):
     """Remove empty rules."""
 
-    return re.sub(r"[^\}\{]+\{\}", "", css)
+    return RE_EMPTY_RULES.sub("", css)
 
 
 def normalize_rgb_colors_to_hex(css):
     """Convert `rgb(51,102,153)` to `#336699`."""
 
-    regex = re.compile(r"rgb\s*\(\s*([0-9,\s]+)\s*\)")
-    match = regex.search(css)
-    while match:
+    def hexcolor(match):
         colors = map(lambda s: s.strip(), match.group(1).split(","))
-        hexcolor = '#%.2x%.2x%.2x' % tuple(map(int, colors))
-        css = css.replace(match.group(), hexcolor)
-        match = regex.search(css)
-    return css
+        return '#%.2x%.2x%.2x' % tuple(map(int, colors))
+
+    return RE_RGB.sub(hexcolor, css)
 
 
 def condense_zero_units(css):
     """Replace `0(px, em, %, etc)` with `0`."""
 
-    return re.sub(r"([\s:])(0)(px|em|%|in|cm|mm|pc|pt|ex)", r"\1\2", css)
+    return RE_ZERO_UNITS.sub(r"\1\2", css)
 
 
 def condense_multidimensional_zeros(css):
     """Replace `:0 0 0 0;`, `:0 0 0;` etc. with `:0;`."""
 
-    css = css.replace(":0 0 0 0;", ":0;")
-    css = css.replace(":0 0 0;", ":0;")
-    css = css.replace(":0 0;", ":0;")
+    def zeros(match):
+        # Keep `background-position:0 0;` valid.
+        if match.group(1):
+            return "background-position:0 0;"
+        return ":0;"
 
-    # Revert `background-position:0;` to the valid `background-position:0 0;`.
+    css = RE_MULTIDIMENSIONAL_ZEROS.sub(zeros, css)
     css = css.replace("background-position:0;", "background-position:0 0;")
 
     return css
@@ -204,35 +218,34 @@ def condense_multidimensional_zeros(css):
 def condense_floating_points(css):
     """Replace `0.6` with `.6` where possible."""
 
-    return re.sub(r"(:|\s)0+\.(\d+)", r"\1.\2", css)
+    return RE_FLOATING_POINTS.sub(r"\1.\2", css)
 
 
 def condense_hex_colors(css):
     """Shorten colors from #AABBCC to #ABC where possible."""
 
-    regex = re.compile(r"([^\"'=\s])(\s*)#([0-9a-fA-F])([0-9a-fA-F])([0-9a-fA-F])([0-9a-fA-F])([0-9a-fA-F])([0-9a-fA-F])")
-    match = regex.search(css)
+    match = RE_HEX_COLORS.search(css)
     while match:
         first = match.group(3) + match.group(5) + match.group(7)
         second = match.group(4) + match.group(6) + match.group(8)
         if first.lower() == second.lower():
             css = css.replace(match.group(), match.group(1) + match.group(2) + '#' + first)
-            match = regex.search(css, match.end() - 3)
+            match = RE_HEX_COLORS.search(css, match.end() - 3)
         else:
-            match = regex.search(css, match.end())
+            match = RE_HEX_COLORS.search(css, match.end())
     return css
 
 
 def condense_whitespace(css):
     """Condense multiple adjacent whitespace characters into one."""
 
-    return re.sub(r"\s+", " ", css)
+    return RE_WHITESPACE.sub(" ", css)
 
 
 def condense_semicolons(css):
     """Condense multiple adjacent semicolon characters into one."""
 
-    return re.sub(r";;+", ";", css)
+    return RE_SEMICOLONS.sub(";", css)
 
 
 def wrap_css_lines(css, line_length):
@@ -240,11 +253,13 @@ def wrap_css_lines(css, line_length):
 
     lines = []
     line_start = 0
-    for i, char in enumerate(css):
+    i = css.find('}')
+    while i >= 0:
         # It's safe to break after `}` characters.
-        if char == '}' and (i - line_start >= line_length):
+        if i - line_start >= line_length:
             lines.append(css[line_start:i + 1])
             line_start = i + 1
+        i = css.find('}', i + 1)
 
     if line_start < len(css):
         lines.append(css[line_start:])
@@ -0,0 +1,201 @@
+"""Copyright (c) 2012 Charles Kaminski (CharlesKaminski@gmail.com)
+
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE."""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from os import getcwd, sep
+from os.path import join
+from optparse import make_option
+from time import time
+import platform
+import sys
+from _Benchmark import generate_corpus, benchmark_corpus, peak_memory
+from _ManageMinimizers import MINIMIZERS, minimizer_names
+from minimizetemplates import Command as MinimizeCommand
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+TEMPLATES = '50'
+SIZE = '16' # Kilobytes
+NUMBERS_INVALID = 'Expected a comma separated list of numbers: %s'
+SHARE_INVALID = 'Expected a number between 0 and 1: %s'
+
+def parse_numbers(value):
+    """Parses a comma separated list of positive integers."""
+    try:
+        numbers = [int(x) for x in value.split(',') if x.strip()]
+    except ValueError:
+        raise CommandError(NUMBERS_INVALID % value)
+    if not numbers or [x for x in numbers if x < 1]:
+        raise CommandError(NUMBERS_INVALID % value)
+    return numbers
+
+class Command(BaseCommand):
+    help = '''Benchmarks the template minimizer.
+
+Times minimize_template_text, the javascript minimizers, the css
+minimizers and the html middleware separately over a generated corpus of
+templates.  The corpus
+is scaled with the --templates, --size, --tag-density, --script-share and
+--style-share options; --templates and --size take comma separated lists
+and every combination is benchmarked.  Use --real to also benchmark the
+templates found in TEMPLATE_DIRS.
+
+Reports throughput in MB/s, per template (or per script/style block)
+latency percentiles and the peak memory of the process.  Results are
+written as JSON to the --output file, or to stdout, so that runs can be
+compared between releases.
+'''
+
+    option_list = BaseCommand.option_list + (
+        make_option('--templates',
+                    action='store', dest='templates', default=TEMPLATES,
+                    metavar='N[,N...]',
+                    help='Number of generated templates. '
+                         'Defaults to %s.' % TEMPLATES),
+        make_option('--size',
+                    action='store', dest='size', default=SIZE,
+                    metavar='KB[,KB...]',
+                    help='Size of each generated template in kilobytes. '
+                         'Defaults to %s.' % SIZE),
+        make_option('--tag-density',
+                    action='store', type='float', dest='tag_density',
+                    default=0.2,
+                    help='Share of html snippets followed by Django markup. '
+                         'Defaults to 0.2.'),
+        make_option('--script-share',
+                    action='store', type='float', dest='script_share',
+                    default=0.2,
+                    help='Share of each template in <script> blocks. '
+                         'Defaults to 0.2.'),
+        make_option('--style-share',
+                    action='store', type='float', dest='style_share',
+                    default=0.1,
+                    help='Share of each template in <style> blocks. '
+                         'Defaults to 0.1.'),
+        make_option('--repeat',
+                    action='store', type='int', dest='repeat', default=3,
+                    help='Times each item is minimized; the fastest time '
+                         'counts.  Defaults to 3.'),
+        make_option('--seed',
+                    action='store', type='int', dest='seed', default=0,
+                    help='Seed of the generated corpus.  Defaults to 0.'),
+        make_option('--real',
+                    action='store_true', dest='real', default=False,
+                    help='Also benchmark the templates in TEMPLATE_DIRS.'),
+        make_option('-o', '--output',
+                    action='store', dest='output', default=None,
+                    metavar='FILE',
+                    help='Write the JSON results to FILE and print a '
+                         'summary.  Defaults to writing JSON to stdout.'),)
+
+    def handle(self, *args, **options):
+
+        for name in ('tag_density', 'script_share', 'style_share'):
+            if not 0 <= options[name] <= 1:
+                raise CommandError(SHARE_INVALID % options[name])
+        if options['script_share'] + options['style_share'] > 1:
+            raise CommandError(SHARE_INVALID %
+                               (options['script_share'] +
+                                options['style_share']))
+        counts = parse_numbers(options['templates'])
+        sizes = parse_numbers(options['size'])
+        repeat = max(1, options['repeat'])
+
+        results = {
+            'created': time(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'minimizers': {
+                'javascript': minimizer_names(MINIMIZERS.get('javascript')),
+                'css': minimizer_names(MINIMIZERS.get('css')),
+                'html': minimizer_names(MINIMIZERS.get('html')),
+                },
+            'repeat': repeat,
+            'corpora': [],
+            }
+
+        for count in counts:
+            for size in sizes:
+                parameters = {
+                    'templates': count,
+                    'size': size * 1024,
+                    'tag_density': options['tag_density'],
+                    'script_share': options['script_share'],
+                    'style_share': options['style_share'],
+                    'seed': options['seed'],
+                    }
+                texts = generate_corpus(count, size * 1024,
+                                        options['tag_density'],
+                                        options['script_share'],
+                                        options['style_share'],
+                                        options['seed'])
+                results['corpora'].append({
+                    'name': 'synthetic-%sx%sKB' % (count, size),
+                    'parameters': parameters,
+                    'stages': benchmark_corpus(texts, repeat),
+                    })
+
+        if options['real']:
+            texts = self.read_templates()
+            results['corpora'].append({
+                'name': 'templates',
+                'parameters': {'templates': len(texts)},
+                'stages': benchmark_corpus(texts, repeat),
+                })
+
+        results['peak_memory_kb'] = peak_memory()
+
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if not options['output']:
+            self.stdout.write(output + '\n')
+            return
+
+        open(options['output'], 'wb').write(output + '\n')
+        for corpus in results['corpora']:
+            print corpus['name']
+            for name in ('template', 'javascript', 'css', 'middleware',
+                         'middleware-hit'):
+                stage = corpus['stages'][name]
+                print ('  %-14s %5s items %7.2f MB/s  '
+                       'p50 %7.2fms  p90 %7.2fms  p99 %7.2fms' % (
+                    name, stage['items'], stage['mb_per_s'],
+                    stage['p50_ms'], stage['p90_ms'], stage['p99_ms']))
+        if results['peak_memory_kb'] is not None:
+            print 'Peak memory: %s KB' % results['peak_memory_kb']
+        print 'Results written to %s' % options['output']
+
+    def read_templates(self):
+        try:
+            dirs = settings.TEMPLATE_DIRS
+        except AttributeError:
+            raise CommandError('You must specify TEMPLATE_DIRS in your '
+                               'settings file.')
+
+        cwd = getcwd()
+        dirs = [join(cwd, x.replace('/', sep).rstrip(sep)) for x in dirs]
+        paths = MinimizeCommand().find_templates(dirs)
+        return [open(path[0], 'rb').read() for path in paths]
@@ -23,11 +23,38 @@ OTHER DEALINGS IN THE SOFTWARE."""
 
 from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
-from os import getcwd, sep, walk, makedirs
-from os.path import join, exists, basename, dirname
+import sys
+from os import getcwd, sep, walk, makedirs, getpid, remove
+from os.path import join, exists, basename, dirname, getsize, relpath
+from os.path import isfile, abspath, splitext
+from fnmatch import fnmatch
 from shutil import move, rmtree
 from optparse import make_option
-from _TemplateTextMinimizer import minimize_template_text
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from time import time
+from _TemplateTextMinimizer import minimize_template_text, set_profiler
+from _TemplateTextMinimizer import minimize_template_stream, minimize_tag_data
+from _TemplateTextMinimizer import set_block_memo, get_block_memo
+from _MinimizerCache import MinimizerCache, BlockMemo, get_fingerprint
+from _TemplateBundle import write_bundle
+from _TemplateGraph import TemplateGraph
+from _Profiler import Profiler
+from _TransferSize import transfer_sizes
+from _TemplateWriter import TemplateWriter, STAGING
+from _TemplateWriter import ManifestError, read_manifest
+from _TemplateWriter import make_dirs, write_file
+from _TemplateWatcher import get_watcher, watch
+from _ManageMinimizers import MINIMIZERS, minimizer_names
+import _ManageMinimizers
+import _SimpleHTMLParser
+import _TemplateKeys
+import _TransferSize
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
 
 ARCHIVE = '_minimizer_archive'
 REVERTED = '_reverted_'
@@ -37,6 +64,134 @@ ARCHIVE_EXISTS = ('A minimizer archive folder already exists.\n'
 ARCHIVE_DOESNT_EXIST = ("The below archive folder doesn't exist.\n"
                         "Check that you shouldn't be reverting the "
                         "coresponding folder: \n%s")
+JOURNAL_EXISTS = ('An interrupted minimizer run left a journal in the '
+                  'below folder.\nUse --resume to finish it or --rollback '
+                  'to undo it: \n%s')
+NOTHING_INTERRUPTED = 'No interrupted minimizer run was found.'
+NO_MANIFEST = ('The below archive folder has no manifest, so single '
+               'templates can not be reverted: \n%s')
+NOTHING_MATCHES = 'No archived template matches: %s'
+NO_ROOTS = 'No template matches the root patterns: %s'
+DYNAMIC_REFERENCES = ('These templates extend or include templates named by '
+                      'variables, which can not be followed; add the '
+                      'templates they load to the roots: \n%s')
+SHADOW_INSIDE = ('The shadow folder can not be inside the below template '
+                 'folder: \n%s')
+JOBS_INVALID = 'The number of jobs must be 1 or greater.'
+THREADS_INVALID = ('The number of threads must be 1 or greater and can not '
+                   'be used with --jobs or --profile.')
+CACHE_SIZE = 100 # Megabytes
+PROFILE_LIMIT = 10 # Templates and stages listed by --profile
+STREAM_SIZE = 4 * 1024 * 1024 # Templates at least this large are streamed
+BLOCK_MEMO_SIZE = 10000 # Script and style blocks remembered by each process
+SKIPPED_EXTENSIONS = ('.py', '.pyc', '.pyo')
+SNIFF_SIZE = 1024 # Bytes read to tell binary files from templates
+
+# Modules whose code minimize_template_text and minimize_tag_data use
+# besides their own; their sources are part of the cache fingerprints
+TEMPLATE_MODULES = (_ManageMinimizers, _TemplateKeys, _TransferSize)
+TAG_MODULES = (_SimpleHTMLParser,)
+
+def is_binary(path):
+    """Returns True if the start of the file holds a NUL byte, which text
+    templates never do."""
+    f = open(path, 'rb')
+    try:
+        return '\0' in f.read(SNIFF_SIZE)
+    finally:
+        f.close()
+
+def read_file_list(path):
+    """Returns the paths listed one per line in a file, or on stdin if path
+    is '-'.  Blank lines are ignored, so the output of git diff --name-only
+    can be used as is."""
+    if path == '-':
+        lines = sys.stdin.readlines()
+    else:
+        f = open(path, 'rb')
+        try:
+            lines = f.readlines()
+        finally:
+            f.close()
+    return [x.strip() for x in lines if x.strip()]
+
+def minimize_template_file(source_path, cache=None, profile=False):
+    """Reads and minimizes a single template.  Module level so that it can
+    be handed to a multiprocessing pool.  If a MinimizerCache is provided,
+    templates that were minimized before by the same minimizers are read
+    from the cache instead.  If profile is True, the stages of minimizing
+    the template are recorded by a Profiler.  Templates of STREAM_SIZE
+    bytes or more are minimized with minimize_template_stream when neither
+    is used, so they are not held in memory several times over, unless the
+    html is minimized for its compressed size.
+
+    Script and style blocks are looked up in the block memo installed with
+    install_block_memo, if any.
+
+    Returns ->
+    (source_path, original_length, minimized_text, worker_pid, seconds,
+     cache_hit, profiler_stages_or_None, (block_hits, block_misses),
+     transfer_details_or_None)
+
+    See minimize_html_for_transfer for the transfer details."""
+
+    start = time()
+    memo = get_block_memo()
+    start_stats = block_stats(memo)
+    compression = MINIMIZERS.compression()
+    if cache is None and not profile and compression is None and \
+       getsize(source_path) >= STREAM_SIZE:
+        f = open(source_path, 'rb')
+        try:
+            minimized = ''.join(minimize_template_stream(f))
+        finally:
+            f.close()
+        return (source_path, getsize(source_path), minimized, getpid(),
+                time() - start, False, None, block_stats(memo, start_stats),
+                None)
+
+    original = open(source_path, 'rb').read()
+    minimized = None
+    if cache is not None:
+        minimized = cache.get(original)
+    cache_hit = minimized is not None
+    stages = None
+    details = None
+    if not cache_hit:
+        if compression is not None:
+            details = {}
+        if profile:
+            profiler = Profiler()
+            set_profiler(profiler)
+            try:
+                minimized = minimize_template_text(original, details)
+            finally:
+                set_profiler(None)
+            stages = profiler.stages
+        else:
+            minimized = minimize_template_text(original, details)
+        if cache is not None:
+            cache.set(original, minimized)
+    return (source_path, len(original), minimized, getpid(), time() - start,
+            cache_hit, stages, block_stats(memo, start_stats), details)
+
+def _minimize_template_task(args):
+    return minimize_template_file(*args)
+
+def install_block_memo(fingerprint, directory=None):
+    """Installs a BlockMemo for the templates minimized by this process.
+    Blocks are also kept in the cache directory if one is given.  Used as
+    the initializer of the worker processes."""
+    store = None
+    if directory:
+        store = MinimizerCache(directory, fingerprint)
+    set_block_memo(BlockMemo(fingerprint, store, BLOCK_MEMO_SIZE))
+
+def block_stats(memo, start=(0, 0)):
+    """Returns the (hits, misses) of memo since start."""
+    if memo is None:
+        return (0, 0)
+    return (memo.hits - start[0], memo.misses - start[1])
 
 class Command(BaseCommand):
     help = '''Use this tool to minimize Django templates after
@@ -62,6 +217,9 @@ The minimizer command uses its own minimizers for html, style tag embeded
     CSS_MINIMIZERS        = [custom_function3, custom_function4,]
     HTML_MINIMIZERS       = [custom_function5, custom_function6,]
 
+    Minimizers may also be given as dotted paths, such as
+    'myapp.minimizers.uglify', which are imported on first use.
+
     To turn off a minimizer, use the following pattern:
     f = lambda x: x
     JAVASCRIPT_MINIMIZER = [f,]
@@ -73,6 +231,11 @@ You can tell the minimizer command to disable an aggressive minimizer
     settings file to disable this final step:
     AGGRESSIVE_HTML_MINIMIZER = False
 
+The default HTML minimizer keeps the whitespace inside <pre> and
+    <textarea> elements and quoted attribute values.  Set the following
+    setting to False to collapse it as well:
+    PRESERVE_HTML_WHITESPACE = False
+
 Method - For each template, the minimizer command:
 1. Replaces any {# NOMINIFY #} {# ENDNOMINIFY #} content with
     a unique identifier and saves the content in memory so that
@@ -104,9 +267,9 @@ The minimizer does not handle script tags inside script tags or
     style tags inside style tags; an unusual occurance.
     eg: <script>bla bla <script> bla</script></script>
 The minimizer collapses all white space not in a django tag,
-    django variable, javascript, or inline css.  This includes
-    whitespace inside <pre>, <textarea>, & similar tags, and
-    whitespace inside html attributes.
+    django variable, javascript, inline css, <pre> or <textarea>
+    element, or quoted html attribute value.  This includes
+    whitespace inside similar tags, such as <code>.
 Use the {# NOMINIFY #} {# ENDNOMINIFY #} comment tags to overcome
     these limiations.
     
@@ -118,7 +281,100 @@ Use the {# NOMINIFY #} {# ENDNOMINIFY #} comment tags to overcome
                     help='Minimize templates.'),
         make_option('-u', '--undo',
                     action='store_true', dest='undo', default=False,
-                    help='Reverts minimized templates from the archive.'),)
+                    help='Reverts minimized templates from the archive.  '
+                         'Template names or shell style patterns given as '
+                         'arguments revert only those templates.'),
+        make_option('--resume',
+                    action='store_true', dest='resume', default=False,
+                    help='Finishes replacing the templates of an '
+                         'interrupted minimize.'),
+        make_option('--rollback',
+                    action='store_true', dest='rollback', default=False,
+                    help='Puts back the templates of an interrupted '
+                         'minimize.'),
+        make_option('-j', '--jobs',
+                    action='store', type='int', dest='jobs', default=1,
+                    help='Number of worker processes used to minimize '
+                         'templates.  Defaults to 1 (no worker processes).'),
+        make_option('--threads',
+                    action='store', type='int', dest='threads', default=1,
+                    help='Number of templates minimized at once by threads '
+                         'of this process.  Useful with external '
+                         'minimizers, which run while other threads wait.'),
+        make_option('--cache',
+                    action='store', dest='cache', default=None,
+                    metavar='DIR',
+                    help='Directory of a persistent cache of minimized '
+                         'templates.  Unchanged templates are read from '
+                         'the cache instead of being minimized again.'),
+        make_option('--cache-size',
+                    action='store', type='int', dest='cache_size',
+                    default=CACHE_SIZE, metavar='MB',
+                    help='Maximum size of the cache in megabytes. '
+                         'Defaults to %s.' % CACHE_SIZE),
+        make_option('--bundle',
+                    action='store', dest='bundle', default=None,
+                    metavar='FILE',
+                    help='Write the minimized templates to a single bundle '
+                         'file for tmin.loaders.BundleLoader instead of '
+                         'replacing the templates.'),
+        make_option('--profile',
+                    action='store_true', dest='profile', default=False,
+                    help='Time every stage of the minimizer and every '
+                         'minimizer function.  Prints the slowest templates '
+                         'and stages.'),
+        make_option('--dry-run',
+                    action='store_true', dest='dry_run', default=False,
+                    help='Minimize templates in memory only.  Nothing in '
+                         'the template directories is changed.'),
+        make_option('--report',
+                    action='store', dest='report', default=None,
+                    metavar='FILE',
+                    help='Write the sizes, gzip and brotli sizes and times '
+                         'of every template and directory to FILE as '
+                         'JSON.'),
+        make_option('--include',
+                    action='append', dest='include', default=None,
+                    metavar='PATTERN',
+                    help='Only minimize templates whose names match the '
+                         'shell style pattern.  May be given more than '
+                         'once.'),
+        make_option('--exclude',
+                    action='append', dest='exclude', default=None,
+                    metavar='PATTERN',
+                    help='Skip templates whose names match the shell style '
+                         'pattern.  May be given more than once.'),
+        make_option('--files-from',
+                    action='store', dest='files_from', default=None,
+                    metavar='FILE',
+                    help='Only minimize the templates listed one per line '
+                         'in FILE, or on stdin if FILE is -.  Paths outside '
+                         'the template directories are ignored, so the '
+                         'output of git diff --name-only can be given.'),
+        make_option('--root',
+                    action='append', dest='roots', default=None,
+                    metavar='PATTERN',
+                    help='Only minimize templates reachable through '
+                         '{% extends %} and {% include %} tags from templates '
+                         'whose names match the shell style pattern.  May be '
+                         'given more than once.  Defaults to the '
+                         'MINIMIZER_ROOTS setting.'),
+        make_option('--dependents',
+                    action='store_true', dest='dependents', default=False,
+                    help='Also minimize the templates that extend or '
+                         'include the selected ones, directly or not.'),
+        make_option('--graph',
+                    action='store', dest='graph', default=None,
+                    metavar='FILE',
+                    help='Write the template dependency graph to FILE as '
+                         'JSON.'),
+        make_option('--watch',
+                    action='store', dest='watch', default=None,
+                    metavar='DIR',
+                    help='Minimize the templates into the shadow folder DIR, '
+                         'then minimize each template again as it changes '
+                         'until interrupted.  The templates are left '
+                         'alone.'),)
 
     def handle(self, *args, **options):
 
@@ -134,14 +390,66 @@ Use the {# NOMINIFY #} {# ENDNOMINIFY #} comment tags to overcome
         dirs = [x.replace('/', sep).rstrip(sep) for x in dirs]
         dirs = [join(cwd,x) for x in dirs]
 
-        if options['undo']:
-            self.revert(dirs)
+        if options.get('resume') or options.get('rollback'):
+            done = self.recover(dirs, options.get('rollback'))
+            if not done:
+                raise CommandError(NOTHING_INTERRUPTED)
+            if options.get('rollback'):
+                self.stdout.write('Successfully rolled back Templates:\n')
+            else:
+                self.stdout.write('Successfully minimized Templates:\n')
+            for d in done:
+                self.stdout.write('%s\n' % d)
+            return 0
+        elif options.get('watch'):
+            self.watch_templates(dirs, options['watch'],
+                                 options.get('include'),
+                                 options.get('exclude'))
+            return 0
+        elif options['undo']:
+            self.revert(dirs, args)
             self.stdout.write('Successfully reverted minimized Templates:\n')
             for d in dirs:
                 self.stdout.write('%s\n' % d)
             return 0
         elif options['minimize']:
-            self.minimize_templates(dirs)
+            jobs = options.get('jobs') or 1
+            if jobs < 1:
+                raise CommandError(JOBS_INVALID)
+            threads = options.get('threads') or 1
+            if threads < 1 or threads > 1 and (jobs > 1 or
+                                               options.get('profile')):
+                raise CommandError(THREADS_INVALID)
+            cache = None
+            if options.get('cache'):
+                fingerprint = get_fingerprint(minimize_template_text,
+                                              TEMPLATE_MODULES, TAG_MODULES,
+                                              MINIMIZERS.get('javascript'),
+                                              MINIMIZERS.get('css'),
+                                              MINIMIZERS.get('html'),
+                                              MINIMIZERS.compression())
+                cache = MinimizerCache(options['cache'], fingerprint,
+                                       options['cache_size'] * 1024 * 1024)
+            files = None
+            if options.get('files_from'):
+                files = read_file_list(options['files_from'])
+            roots = options.get('roots') or getattr(settings,
+                                                    'MINIMIZER_ROOTS', None)
+            graph = None
+            if roots or options.get('dependents') or options.get('graph'):
+                graph = TemplateGraph()
+            paths = self.find_templates(dirs, options.get('include'),
+                                        options.get('exclude'), files, graph,
+                                        roots, options.get('dependents'))
+            if graph is not None:
+                self.report_graph(graph, roots, options.get('graph'))
+            self.minimize_templates(dirs, jobs, cache, options.get('bundle'),
+                                    options.get('profile'), threads,
+                                    options.get('dry_run'),
+                                    options.get('report'), paths)
+            if options.get('dry_run'):
+                self.stdout.write('Dry run; no templates were changed.\n')
+                return 0
             self.stdout.write('Successfully minimized Templates:\n')
             for d in dirs:
                 self.stdout.write('%s\n' % d)
@@ -150,95 +458,516 @@ Use the {# NOMINIFY #} {# ENDNOMINIFY #} comment tags to overcome
             command_name = basename(__file__).rstrip('.py')
             self.print_help(command_name, '')
 
-    def minimize_templates(self, dirs):
-
-        # Check that the archive folders don't already exist
-        for d in dirs:
-            if exists(join(d, ARCHIVE)):
-                raise CommandError(ARCHIVE_EXISTS % d)
+    def find_templates(self, dirs, include=None, exclude=None, files=None,
+                       graph=None, roots=None, dependents=False):
+        """Walks the template directories, or looks up the given file paths
+        in them.  Templates are kept if their names match one of the
+        include patterns, if any, and none of the exclude patterns.  Python
+        and binary files are skipped.
+
+        If a TemplateGraph is given, every template is read into it, and
+        only templates reachable from the root patterns, if any, are kept.
+        If dependents is True, the templates that extend or include the
+        listed files are kept as well.  Returns ->
+        [[path, archive_path, template_name, template_dir], ...]"""
+
+        walked = None
+        if files is None or graph is not None:
+            walked = self.walk_templates(dirs)
+        if graph is not None:
+            for path, template_name, d in walked:
+                if splitext(path)[1] not in SKIPPED_EXTENSIONS and \
+                   not is_binary(path):
+                    graph.add(template_name, open(path, 'rb').read())
+
+        if files is None:
+            found = walked
+        else:
+            found = self.lookup_templates(dirs, files)
+            if dependents:
+                names = graph.dependents([x[1] for x in found])
+                listed = set([(x[1], x[2]) for x in found])
+                found = found + [x for x in walked if x[1] in names and
+                                 (x[1], x[2]) not in listed]
+        reachable = roots and graph.reachable(roots)
 
         paths = []
-        # Walk the directories to build a list of files to minimize
+        for path, template_name, d in found:
+            if splitext(path)[1] in SKIPPED_EXTENSIONS:
+                continue
+            if include and not [x for x in include
+                                if fnmatch(template_name, x)]:
+                continue
+            if exclude and [x for x in exclude if fnmatch(template_name, x)]:
+                continue
+            if roots and template_name not in reachable:
+                continue
+            if is_binary(path):
+                continue
+            archive_path = join(d, ARCHIVE, *template_name.split('/'))
+            paths.append([path, archive_path, template_name, d])
+        return paths
+
+    def report_graph(self, graph, roots=None, path=None):
+        """Prints how many templates are reachable from the roots and warns
+        about root patterns that match no template and references that can
+        not be followed.  Writes the graph to path if given."""
+        if roots:
+            reachable = graph.reachable(roots)
+            print 'Roots:    %s of %s templates reachable from %s' % (
+                len([x for x in graph.extends if x in reachable]),
+                len(graph.extends), ', '.join(roots))
+            unmatched = [x for x in roots
+                         if not [y for y in graph.extends if fnmatch(y, x)]]
+            if unmatched:
+                print NO_ROOTS % ', '.join(unmatched)
+            dynamic = sorted(graph.dynamic & reachable)
+            if dynamic:
+                print DYNAMIC_REFERENCES % '\n'.join(dynamic)
+        if path:
+            graph.write(path, roots)
+
+    def walk_templates(self, dirs):
+        """Returns every file in the template directories ->
+        [(path, template_name, template_dir), ...]"""
+
+        found = []
         # Currently not following symbolic links
         for d in dirs:
-            archive_dir = join(d, ARCHIVE)
             for root, walk_dirs, files in walk(d):
                 reverted_dirs = [x for x in walk_dirs if x.startswith(REVERTED)]
                 for reverted_dir in reverted_dirs:
                     walk_dirs.remove(reverted_dir)  
+                if root == d:
+                    for skipped in (ARCHIVE, STAGING):
+                        if skipped in walk_dirs:
+                            walk_dirs.remove(skipped)
                 for name in files:
-                    if not name.split('.')[-1] in ('.py', '.pyc'):
-                        path= join(root,name)
-                        paths.append([path, path.replace(d, archive_dir)])
+                    path= join(root,name)
+                    template_name = path[len(d):].lstrip(sep)
+                    template_name = template_name.replace(sep, '/')
+                    found.append((path, template_name, d))
+        return found
+
+    def lookup_templates(self, dirs, files):
+        """Returns the listed files that exist inside a template directory
+        ->  [(path, template_name, template_dir), ...]  Relative paths are
+        relative to the current directory."""
+
+        found = []
+        seen = set()
+        for x in files:
+            path = abspath(x.replace('/', sep))
+            # The innermost template directory holding the file
+            holders = [d for d in dirs if path.startswith(abspath(d) + sep)]
+            if not holders or path in seen or not isfile(path):
+                continue
+            d = max(holders, key=len)
+            template_name = path[len(abspath(d)):].lstrip(sep)
+            template_name = template_name.replace(sep, '/')
+            top = template_name.split('/')[0]
+            if top in (ARCHIVE, STAGING) or top.startswith(REVERTED):
+                continue
+            seen.add(path)
+            found.append((path, template_name, d))
+        return found
+
+    def minimize_templates(self, dirs, jobs=1, cache=None, bundle=None,
+                           profile=False, threads=1, dry_run=False,
+                           report=None, paths=None):
+
+        # Check that the archive folders don't already exist
+        if not bundle and not dry_run:
+            for d in dirs:
+                if TemplateWriter(d, join(d, ARCHIVE)).pending():
+                    raise CommandError(JOURNAL_EXISTS % d)
+                if exists(join(d, ARCHIVE)):
+                    raise CommandError(ARCHIVE_EXISTS % d)
 
-        # Minimize the files
-        num_files, before, after = 0, 0, 0
-        for source_path, archive_path in paths:
-            original = ''.join(open(source_path).readlines())
-            minimized = minimize_template_text(original)
+        # Walk the directories to build a list of files to minimize
+        if paths is None:
+            paths = self.find_templates(dirs)
+        if not paths:
+            print 'Files:    0, no templates selected'
+            return
+
+        # Minimize the files.  Every template is minimized before anything
+        # is moved so that a failure part way through leaves the template
+        # directories untouched.
+        # Script and style blocks are remembered across templates by each
+        # process, and across runs in the cache directory
+        tasks = [(path[0], cache, profile) for path in paths]
+        memo_args = (get_fingerprint(minimize_tag_data, TAG_MODULES,
+                                     MINIMIZERS.get('javascript'),
+                                     MINIMIZERS.get('css')),
+                     cache and cache.directory)
+        block_hits, block_misses = 0, 0
+        if jobs > 1:
+            pool = Pool(jobs, install_block_memo, memo_args)
+            try:
+                chunksize = max(1, len(tasks) // (jobs * 4))
+                results = pool.map(_minimize_template_task, tasks, chunksize)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            install_block_memo(*memo_args)
+            try:
+                if threads > 1:
+                    pool = ThreadPool(threads)
+                    try:
+                        results = pool.map(_minimize_template_task, tasks)
+                    finally:
+                        pool.close()
+                        pool.join()
+                else:
+                    results = map(_minimize_template_task, tasks)
+                # Threads share the memo, so count its hits once
+                block_hits, block_misses = block_stats(get_block_memo())
+            finally:
+                set_block_memo(None)
+
+        num_files, before, after, hits = 0, 0, 0, 0
+        # Compressed sizes with the html chain and with the compression
+        # aware html minimizer
+        chain_size, transfer_size = 0, 0
+        workers = {}
+        templates = []
+        profiler = Profiler()
+        # format -> [(seconds, source_path), ...]
+        timings = []
+        # format -> [report_entry, ...]
+        entries = []
+        # format -> {template_dir: [(template_name, text), ...], ...}
+        writes = {}
+        for (source_path, archive_path, name, d), result in zip(paths,
+                                                                results):
+            original_length, minimized, pid, seconds, cache_hit = result[1:6]
+            if result[6] is not None:
+                profiler.merge(result[6])
+                timings.append((result[6]['template'][1], source_path))
+            details = result[8]
+            if details is not None:
+                chain_size = chain_size + details['chain_size']
+                transfer_size = transfer_size + details['size']
 
             num_files = num_files + 1
-            before = before + len(original)
+            hits = hits + cache_hit
+            if jobs > 1:
+                block_hits = block_hits + result[7][0]
+                block_misses = block_misses + result[7][1]
+            before = before + original_length
             after = after + len(minimized)
 
-            d = dirname(archive_path)
-            if not exists(d):
-                makedirs(d)
-            move(source_path, archive_path)
-            open(source_path, 'wb').write(minimized)
+            # format -> {pid: [files, bytes, seconds], ...}
+            worker = workers.setdefault(pid, [0, 0, 0.0])
+            worker[0] = worker[0] + 1
+            worker[1] = worker[1] + original_length
+            worker[2] = worker[2] + seconds
+
+            if report:
+                entries.append(self.report_entry(source_path, name,
+                                                 minimized, seconds, details))
+            if dry_run:
+                continue
+            if bundle:
+                templates.append((name, minimized))
+                continue
+            writes.setdefault(d, []).append((name, minimized))
+
+        # Replace the templates; see TemplateWriter.  Every directory is
+        # staged before any template is replaced, and every journal is kept
+        # until every directory is done, so that an interrupted run can be
+        # resumed or rolled back as a whole.
+        staged = []
+        for d in dirs:
+            if d in writes:
+                writer = TemplateWriter(d, join(d, ARCHIVE))
+                staged.append((writer, writer.stage(writes[d])))
+        for writer, journal_entries in staged:
+            writer.commit(journal_entries, False)
+        for writer, journal_entries in staged:
+            writer.finish()
 
         print 'Files:    %s' % num_files
         print 'Before:   %s' % before
         print 'After:    %s' % after
         print "Decrease: {0:.0%}".format((before - after) / float(before))
+        if chain_size:
+            print 'Transfer: %s bytes %s, %s with the html chain, %.1f%% ' \
+                  'smaller' % (transfer_size, MINIMIZERS.compression(),
+                               chain_size,
+                               100.0 * (chain_size - transfer_size) /
+                               chain_size)
+
+        if report:
+            self.write_report(report, entries, dry_run)
+            print 'Report:   %s' % report
+
+        if bundle and not dry_run:
+            count = write_bundle(bundle, templates)
+            print 'Bundle:   %s (%s templates)' % (bundle, count)
+
+        blocks = block_hits + block_misses
+        if blocks:
+            print 'Blocks:   %s hits, %s misses, %.0f%% hit rate' % (
+                block_hits, block_misses, 100.0 * block_hits / blocks)
+
+        if cache:
+            print 'Cache:    %s hits, %s misses' % (hits, num_files - hits)
+            cache.prune()
+
+        if profile:
+            self.print_profile(profiler, timings)
+
+        if jobs > 1:
+            for pid in sorted(workers):
+                files, size, seconds = workers[pid]
+                rate = seconds and size / seconds / 1024 or 0
+                print 'Worker %s: %s files, %s bytes, %.2fs, %.1f KB/s' % (
+                    pid, files, size, seconds, rate)
+
+    def watch_templates(self, dirs, shadow_dir, include=None, exclude=None):
+        """Minimizes the templates into shadow_dir, then minimizes each
+        template again as it changes, until interrupted.  A name in more
+        than one template folder is taken from the first, as Django's
+        loaders do, so shadow_dir can stand in for TEMPLATE_DIRS."""
+
+        shadow_dir = abspath(shadow_dir)
+        for d in dirs:
+            if shadow_dir == abspath(d) or \
+               shadow_dir.startswith(abspath(d) + sep):
+                raise CommandError(SHADOW_INSIDE % d)
+
+        # The template folder each shadow template was read from
+        # format -> {template_name: template_dir, ...}
+        owners = {}
+        start = time()
+        paths = self.find_templates(dirs, include, exclude)
+        self.shadow_templates(dirs, shadow_dir, paths, owners)
+        print 'Minimized %s templates into %s in %.1f s' % (
+            len(owners), shadow_dir, time() - start)
+        print 'Watching for changes; press Ctrl-C to stop.'
+
+        def changed(changed_paths):
+            removed = [abspath(x) for x in changed_paths if not exists(x)]
+            paths = self.find_templates(dirs, include, exclude,
+                                        [x for x in changed_paths
+                                         if exists(x)])
+            for path in removed:
+                self.unshadow_template(dirs, shadow_dir, path, owners,
+                                       include, exclude)
+            self.shadow_templates(dirs, shadow_dir, paths, owners, True)
 
-    def revert(self, dirs):
-        # Put together Archive dirs
-        # Check  the archive folders do exist
-        archive_dirs = []
+        try:
+            watch(get_watcher(dirs), changed)
+        except KeyboardInterrupt:
+            print 'Stopped watching.'
+
+    def shadow_templates(self, dirs, shadow_dir, paths, owners,
+                         verbose=False):
+        """Minimizes the templates into shadow_dir.  Templates hidden by a
+        template of the same name in an earlier template folder are
+        skipped.  A template that fails to minimize is reported and its
+        previous shadow copy, if any, is left in place."""
+        for source_path, archive_path, name, d in paths:
+            if name in owners and \
+               dirs.index(owners[name]) < dirs.index(d):
+                continue
+            try:
+                result = minimize_template_file(source_path)
+                original_length, minimized, pid, seconds = result[1:5]
+                path = join(shadow_dir, *name.split('/'))
+                make_dirs(dirname(path))
+                write_file(path, minimized, False)
+            except Exception, e:
+                print '%s: failed, %s: %s' % (name, e.__class__.__name__, e)
+                continue
+            owners[name] = d
+            if verbose:
+                print '%s: %s -> %s bytes in %.1f ms' % (
+                    name, original_length, len(minimized), seconds * 1000)
+
+    def unshadow_template(self, dirs, shadow_dir, source_path, owners,
+                          include=None, exclude=None):
+        """Handles a removed template; the template of the same name in a
+        later template folder, if any, takes its place in shadow_dir."""
+        for d in dirs:
+            if source_path.startswith(abspath(d) + sep):
+                name = source_path[len(abspath(d)):].lstrip(sep)
+                name = name.replace(sep, '/')
+                if owners.get(name) == d:
+                    break
+        else:
+            return
+        del owners[name]
+        files = [join(x, *name.split('/')) for x in dirs if x != d]
+        paths = self.find_templates(dirs, include, exclude,
+                                    [x for x in files if exists(x)])
+        if paths:
+            self.shadow_templates(dirs, shadow_dir, paths[:1], owners, True)
+        else:
+            path = join(shadow_dir, *name.split('/'))
+            if exists(path):
+                remove(path)
+            print '%s: removed' % name
+
+    def report_entry(self, source_path, name, minimized, seconds,
+                     details=None):
+        """Returns the sizes and time of one template for --report.
+        details are the transfer details from minimize_template_file."""
+        original = open(source_path, 'rb').read()
+        return {
+            'path': source_path,
+            'template': name,
+            'directory': dirname(source_path),
+            'seconds': seconds,
+            'original': transfer_sizes(original),
+            'minimized': transfer_sizes(minimized),
+            'transfer': details,
+            }
+
+    def write_report(self, path, entries, dry_run=False):
+        """Writes the --report JSON; the templates, the totals of each
+        directory and the totals of the run."""
+
+        def total(items):
+            sizes = {}
+            for kind in ('original', 'minimized'):
+                sizes[kind] = {}
+                for size in ('bytes', 'gzip', 'brotli'):
+                    values = [x[kind][size] for x in items]
+                    if None in values:
+                        sizes[kind][size] = None
+                    else:
+                        sizes[kind][size] = sum(values)
+            sizes['files'] = len(items)
+            sizes['seconds'] = sum([x['seconds'] for x in items])
+            return sizes
+
+        # format -> {directory: [report_entry, ...], ...}
+        directories = {}
+        for entry in entries:
+            directories.setdefault(entry['directory'], []).append(entry)
+
+        results = {
+            'created': time(),
+            'dry_run': bool(dry_run),
+            'minimizers': {
+                'javascript': minimizer_names(MINIMIZERS.get('javascript')),
+                'css': minimizer_names(MINIMIZERS.get('css')),
+                'html': minimizer_names(MINIMIZERS.get('html')),
+                },
+            'templates': entries,
+            'directories': dict([(d, total(items))
+                                 for d, items in directories.items()]),
+            'total': total(entries),
+            }
+        open(path, 'wb').write(json.dumps(results, indent=2, sort_keys=True)
+                               + '\n')
+
+    def print_profile(self, profiler, timings):
+        timings.sort(reverse=True)
+        print 'Slowest templates:'
+        for seconds, path in timings[:PROFILE_LIMIT]:
+            print '  %9.2fms  %s' % (seconds * 1000, path)
+        print 'Slowest stages:'
+        print '  %9s  %7s  %10s  %10s  %s' % ('time', 'calls', 'bytes in',
+                                             'bytes out', 'stage')
+        for stage, calls, seconds, size_in, size_out in \
+                profiler.slowest(PROFILE_LIMIT):
+            print '  %9.2fms  %7s  %10s  %10s  %s' % (
+                seconds * 1000, calls, size_in, size_out, stage)
+
+    def recover(self, dirs, rollback=False):
+        """Resumes or rolls back an interrupted minimize.  Returns the
+        template directories it was interrupted in."""
+        done = []
+        writers = []
+        for d in dirs:
+            writer = TemplateWriter(d, join(d, ARCHIVE))
+            if writer.pending():
+                if rollback:
+                    writer.rollback()
+                else:
+                    writer.resume(False)
+                    writers.append(writer)
+                done.append(d)
+        for writer in writers:
+            writer.finish()
+        return done
+
+    def revert(self, dirs, patterns=None):
+        """Puts back the archived templates, or those whose names match
+        one of the patterns.  The minimized templates are moved to a new
+        _reverted_ folder."""
+
+        # Check the archive folders do exist
         for d in dirs:
             archive_dir = join(d, ARCHIVE)
-            archive_dirs.append(archive_dir)
             if not exists(archive_dir):
                 raise CommandError(ARCHIVE_DOESNT_EXIST % archive_dir)
+            if patterns and read_manifest(archive_dir) is None:
+                raise CommandError(NO_MANIFEST % archive_dir)
 
-        # Put together reverted dirs
-        reverted_dirs = []
+        # Check every archived original before anything is moved
+        restores = []
         for d in dirs:
+            writer = TemplateWriter(d, join(d, ARCHIVE))
+            if read_manifest(writer.archive_dir) is None:
+                # Archived before manifests were written
+                restores.append((d, None, None, None))
+                continue
+            try:
+                names, changed = writer.verify(patterns)
+            except ManifestError, e:
+                raise CommandError(str(e))
+            restores.append((d, writer, names, changed))
+
+        restored = 0
+        for d, writer, names, changed in restores:
             i = 1
             while exists(join(d, REVERTED + str(i))):
                 i = i + 1
-            reverted_dirs.append(join(d, REVERTED + str(i)))
-
-        # zip everything up
-        all_dirs = zip(archive_dirs, dirs, reverted_dirs)
+            reverted_dir = join(d, REVERTED + str(i))
+
+            if writer is None:
+                restored = restored + self.revert_archive(join(d, ARCHIVE), d,
+                                                          reverted_dir)
+                continue
+            if names:
+                writer.restore(reverted_dir, names)
+            restored = restored + len(names)
+            for name in changed:
+                print ('Changed since it was minimized, kept in %s: %s' %
+                       (reverted_dir, name))
+
+        if patterns and not restored:
+            raise CommandError(NOTHING_MATCHES % ', '.join(patterns))
+
+    def revert_archive(self, archive_dir, d, reverted_dir):
+        """Puts back every template of an archive folder without a manifest
+        by walking it.  Returns the number of templates put back."""
 
-        # Walk the directories and put together paths
         paths = []
-        for archive_dir, d, reverted_dir in all_dirs:
-            for root, walk_dirs, files in walk(archive_dir):
-                reverted_dirs = [x for x in walk_dirs if x.startswith(REVERTED)]
-                for reverted_dir in reverted_dirs:
-                    walk_dirs.remove(reverted_dir)                
-                for archive_name in files:
-                    # Collect all the paths
-                    archive_path = join(root, archive_name)
-                    path = archive_path.replace(archive_dir, d)
-                    reverted_path = archive_path.replace(archive_dir,
-                                                         reverted_dir)
-                    paths.append([archive_path, path, reverted_path])
+        for root, walk_dirs, files in walk(archive_dir):
+            for name in [x for x in walk_dirs if x.startswith(REVERTED)]:
+                walk_dirs.remove(name)
+            for archive_name in files:
+                archive_path = join(root, archive_name)
+                relative_path = relpath(archive_path, archive_dir)
+                paths.append([archive_path, join(d, relative_path),
+                              join(reverted_dir, relative_path)])
 
         # Make the moves
         for archive_path, path, reverted_path in paths:
             # Create the directories
-            d = dirname(path)
-            if not exists(d): makedirs(d)
-            d = dirname(reverted_path)
-            if not exists(d): makedirs(d)
-
-            move(path, reverted_path)
+            for parent in (dirname(path), dirname(reverted_path)):
+                if not exists(parent): makedirs(parent)
+            if exists(path):
+                move(path, reverted_path)
             move(archive_path, path)
 
         # Delete the archive folder
-        for d in archive_dirs:
-            rmtree(d)
+        rmtree(archive_dir)
+        return len(paths)
@@ -0,0 +1,186 @@
+"""Copyright (c) 2012 Charles Kaminski (CharlesKaminski@gmail.com)
+
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE."""
+
+import re
+from hashlib import sha1
+from django.conf import settings
+from tmin.management.commands._ManageMinimizers import HTMLMIN1, HTMLMIN2
+from tmin.management.commands._ManageMinimizers import MINIMIZERS
+from tmin.management.commands._ManageMinimizers import resolve_chain
+from tmin.management.commands._ManageMinimizers import collapse_whitespace
+from tmin.management.commands._ManageMinimizers import html_cut
+from tmin.management.commands._MinimizerCache import LRUCache
+
+FLAGS = re.IGNORECASE + re.DOTALL
+
+# Blocks whose whitespace matters.  They are passed through untouched.
+PROTECTED = r'<(SCRIPT|STYLE|PRE|TEXTAREA)\b.*?</\1\s*>'
+OPEN_PROTECTED = r'<(?:SCRIPT|STYLE|PRE|TEXTAREA)\b'
+
+RE_PROTECTED = re.compile(PROTECTED, flags=FLAGS)
+RE_OPEN_PROTECTED = re.compile(OPEN_PROTECTED, flags=FLAGS)
+
+# Responses smaller than this many bytes are left alone
+MIDDLEWARE_MIN_SIZE = 512
+# Number of minimized responses kept in memory by each process
+MIDDLEWARE_CACHE_SIZE = 1000
+
+def minimize_html(text, minimizers=None, before=''):
+    """Runs the html minimizers over rendered html.  Script, style, pre and
+    textarea blocks are left alone, but the whitespace between them is
+    minimized as if they were not, so '</pre> <textarea>' loses its space
+    as it does in a minimized template.  minimizers is a chain of
+    functions or dotted paths; the registered html chain by default.
+    before is the character that comes before text when text is a piece
+    of a larger page; see minimize_html_stream."""
+    if minimizers is None:
+        minimizers = MINIMIZERS.get('html')
+    else:
+        minimizers = resolve_chain(minimizers)
+    pieces = []
+    position = 0
+    for match in RE_PROTECTED.finditer(text):
+        pieces.append(run_chain(text[position:match.start()], minimizers,
+                                before, '<'))
+        pieces.append(match.group())
+        position = match.end()
+        before = '>'
+    pieces.append(run_chain(text[position:], minimizers, before))
+    return ''.join(pieces)
+
+def run_chain(text, minimizers, before='', after=''):
+    """Runs the chain over text as it would run over before + text + after;
+    the characters around text are what the minimizers see next to it."""
+    if not text:
+        return text
+    text = before + text + after
+    # The regular expression chains are done with string methods; several
+    # times faster than the regular expressions
+    if minimizers == [HTMLMIN1, HTMLMIN2]:
+        text = collapse_whitespace(text).replace('> <', '><')
+    elif minimizers == [HTMLMIN1]:
+        text = collapse_whitespace(text)
+    else:
+        for f in minimizers: text = f(text)
+    return text[len(before):len(text) - len(after)]
+
+def minimize_html_stream(chunks, minimizers=None):
+    """Minimizes html given as an iterable of strings and yields the
+    minimized html a piece at a time.  ''.join() of the pieces is the same
+    as minimize_html of the whole text.
+
+    The text is cut after a protected block or before a tag that follows
+    a character other than whitespace, outside of any pre, textarea or
+    quoted attribute value, before any protected block that is still open
+    and before the last tag, which may be incomplete.  The html minimizers
+    are assumed to only change whitespace, as the default ones do.
+    """
+    if minimizers is None:
+        minimizers = MINIMIZERS.get('html')
+    minimizers = resolve_chain(minimizers)
+    carry = ''
+    # The last character of the text minimized so far
+    before = ''
+    for chunk in chunks:
+        if not chunk:
+            continue
+        text = carry + chunk
+        end = safe_end(text)
+        carry = text[end:]
+        if end:
+            yield minimize_html(text[:end], minimizers, before)
+            before = text[end - 1]
+    if carry:
+        yield minimize_html(carry, minimizers, before)
+
+def safe_end(text):
+    """Returns where text can be cut so minimize_html of both sides gives
+    the same result as minimize_html of text."""
+    position = 0
+    for match in RE_PROTECTED.finditer(text):
+        if RE_OPEN_PROTECTED.search(text, position, match.start()):
+            # A block before this one is not closed yet
+            break
+        position = match.end()
+    match = RE_OPEN_PROTECTED.search(text, position)
+    end = len(text)
+    if match is not None:
+        end = match.start()
+    # The text before the last '<', which may start an incomplete tag
+    return position + html_cut(text[position:end + 1])
+
+class MinimizeHTMLMiddleware(object):
+    """Runs the html minimizers over text/html responses, removing the
+    whitespace that comes from {% include %} tags and variables.
+
+        MIDDLEWARE_CLASSES = (
+            'django.middleware.gzip.GZipMiddleware',
+            'tmin.middleware.MinimizeHTMLMiddleware',
+            ...
+        )
+
+    Place it after GZipMiddleware so it sees the response first.  Script,
+    style, pre and textarea blocks are left alone.  Responses are cached
+    in an LRU cache keyed by a hash of their body, so a page served again
+    unchanged is not minimized twice.  Streaming responses are minimized a
+    piece at a time and are not cached.
+    """
+
+    def __init__(self):
+        self.min_size = getattr(settings, 'MINIMIZER_MIDDLEWARE_MIN_SIZE',
+                                MIDDLEWARE_MIN_SIZE)
+        size = getattr(settings, 'MINIMIZER_MIDDLEWARE_CACHE_SIZE',
+                       MIDDLEWARE_CACHE_SIZE)
+        self.cache = LRUCache(size)
+
+    def process_response(self, request, response):
+        # Fast path; most responses are skipped by the first checks
+        content_type = response.get('Content-Type', '')
+        if content_type[:9].lower() != 'text/html' or \
+           response.has_header('Content-Encoding'):
+            return response
+
+        if getattr(response, 'streaming', False):
+            response.streaming_content = minimize_html_stream(
+                response.streaming_content)
+            if response.has_header('Content-Length'):
+                del response['Content-Length']
+            return response
+
+        content = response.content
+        if len(content) < self.min_size:
+            return response
+        response.content = self.minimize(content)
+        if response.has_header('Content-Length'):
+            response['Content-Length'] = str(len(response.content))
+        return response
+
+    def minimize(self, content):
+        """Returns the minimized content, from the cache if it was
+        minimized before."""
+        key = sha1(content).digest()
+        text = self.cache.get(key)
+        if text is None:
+            text = minimize_html(content)
+            self.cache.set(key, text)
+        return text